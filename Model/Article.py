@@ -1,12 +1,31 @@
 import orm
 from orm import Model
+from Model.Category import Category
+from tool import fit_html
 class Article(Model):
     id = orm.IntegerField('id', primary_key=True)
     title = orm.StringField('title', type='varchar(30)')
-    content = orm.StringField('content', type="mediumtext")
-    catid = orm.IntegerField('catid', type='tinyint')
-    tag = orm.StringField('tag', type='varchar(25)')
+    content = orm.StringField('content', type="mediumtext", deferred=True)
+    catid = orm.IntegerField('catid', type='tinyint', index=True)
+    tag = orm.StringField('tag', type='varchar(25)', index=True)
     description = orm.StringField('description')
-    created_at = orm.IntegerField('created_at')
+    created_at = orm.IntegerField('created_at', index=True)
     comment_count = orm.IntegerField('comment_count')
-    view_count = orm.IntegerField("view_count")
\ No newline at end of file
+    view_count = orm.IntegerField("view_count")
+    category = orm.ForeignKey(Category, 'catid')
+
+    __excerpt__ = 200
+
+    def beforeSave(self):
+        description = self.getValue('description')
+        if description:
+            self.description = fit_html(description, 255, 255)
+        elif self.getValue('content'):
+            self.description = fit_html(self.content, self.__excerpt__, 255)
+
+    @classmethod
+    def beforeUpdate(cls, values):
+        if 'content' in values and 'description' not in values:
+            values['description'] = fit_html(values['content'], cls.__excerpt__, 255)
+
+Article.counter = orm.Counter(Article, ['view_count', 'comment_count'])
\ No newline at end of file
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import os, hashlib, gzip, mimetypes, logging, json, time
+from aiohttp import web
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.xml')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=3600'
+
+def acceptEncodings(header):
+    encodings = set()
+    for part in (header or '').split(','):
+        token, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if token:
+            encodings.add(token.strip().lower())
+    return encodings
+
+
+class Asset():
+    def __init__(self, name, url, digest, content_type, body):
+        self.name = name
+        self.url = url
+        self.digest = digest
+        self.content_type = content_type
+        self.variants = {'identity': body}
+
+    def response(self, request, immutable):
+        accepted = acceptEncodings(request.headers.get('Accept-Encoding'))
+        encoding = 'identity'
+        for e in ('br', 'gzip'):
+            if e in self.variants and e in accepted:
+                encoding = e
+                break
+        etag = '"{}"'.format(self.digest if encoding == 'identity' else '{}-{}'.format(self.digest, encoding))
+        headers = {
+            'ETag': etag,
+            'Cache-Control': IMMUTABLE if immutable else REVALIDATE,
+            'Vary': 'Accept-Encoding'
+        }
+        inm = request.headers.get('If-None-Match')
+        if inm is not None and etag in [t.strip() for t in inm.split(',')]:
+            return web.Response(status=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return web.Response(body=self.variants[encoding], content_type=self.content_type, headers=headers)
+
+
+class Assets():
+    def __init__(self, root, build, prefix='/static/', brotli=True, level=9):
+        self.root = root
+        self._build = build
+        self._prefix = prefix
+        self._brotli = brotli
+        self._level = level
+        self._files = dict()
+        self.manifest = dict()
+
+    def _write(self, path, data, overwrite=False):
+        # fingerprinted files never change content, so existing ones are kept
+        if os.path.exists(path) and not overwrite:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _compress(self, asset, target):
+        body = asset.variants['identity']
+        gz = target + '.gz'
+        if os.path.exists(gz):
+            with open(gz, 'rb') as f:
+                asset.variants['gzip'] = f.read()
+        else:
+            asset.variants['gzip'] = gzip.compress(body, self._level)
+            self._write(gz, asset.variants['gzip'])
+        if brotli is not None and self._brotli:
+            br = target + '.br'
+            if os.path.exists(br):
+                with open(br, 'rb') as f:
+                    asset.variants['br'] = f.read()
+            else:
+                asset.variants['br'] = brotli.compress(body)
+                self._write(br, asset.variants['br'])
+        for e in ('gzip', 'br'):
+            if e in asset.variants and len(asset.variants[e]) >= len(body):
+                del asset.variants[e]
+
+    def build(self):
+        start = time.perf_counter()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    body = f.read()
+                digest = hashlib.md5(body).hexdigest()[:12]
+                base, ext = os.path.splitext(name)
+                fingerprinted = '{}.{}{}'.format(base, digest, ext)
+                target = os.path.join(self._build, fingerprinted)
+                self._write(target, body)
+                self._add(name, fingerprinted, digest, body)
+        os.makedirs(self._build, exist_ok=True)
+        self._write(os.path.join(self._build, 'manifest.json'), json.dumps(self.manifest, indent=2, sort_keys=True).encode('utf-8'), overwrite=True)
+        logging.info("built {} static files in {:.1f}ms".format(len(self.manifest), (time.perf_counter() - start) * 1000))
+
+    def load(self):
+        # serve what build() left in the build directory without writing anything
+        start = time.perf_counter()
+        with open(os.path.join(self._build, 'manifest.json'), 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+        for name, fingerprinted in manifest.items():
+            with open(os.path.join(self._build, fingerprinted), 'rb') as f:
+                body = f.read()
+            digest = os.path.splitext(fingerprinted)[0].rpartition('.')[2]
+            self._add(name, fingerprinted, digest, body)
+        logging.info("loaded {} static files in {:.1f}ms".format(len(self.manifest), (time.perf_counter() - start) * 1000))
+
+    def _add(self, name, fingerprinted, digest, body):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        asset = Asset(name, self._prefix + fingerprinted, digest, content_type, body)
+        if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+            self._compress(asset, os.path.join(self._build, fingerprinted))
+        self._files[name] = (asset, False)
+        self._files[fingerprinted] = (asset, True)
+        self.manifest[name] = fingerprinted
+
+    def export(self, target):
+        suffix = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+        for name, (asset, immutable) in self._files.items():
+            if not immutable:
+                continue
+            for encoding, body in asset.variants.items():
+                self._write(os.path.join(target, name + suffix[encoding]), body)
+
+    def url(self, name):
+        name = name.lstrip('/')
+        fingerprinted = self.manifest.get(name)
+        if fingerprinted is None:
+            return self._prefix + name
+        return self._prefix + fingerprinted
+
+    async def handle(self, request):
+        item = self._files.get(request.match_info['path'])
+        if item is None:
+            raise web.HTTPNotFound()
+        asset, immutable = item
+        return asset.response(request, immutable)
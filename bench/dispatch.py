@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+# python -m bench.dispatch [calls]
+import sys, time, json, asyncio, inspect
+from urllib import parse
+from multidict import MultiDict, MultiDictProxy
+from aiohttp import web
+from webframe import RequestHandler, hasRequestArgs
+
+
+class LegacyRequestHandler():
+    # RequestHandler.__call__ as it was before the compiled binder
+    def __init__(self, func):
+        self._func = func
+        self._requiredArgs = inspect.signature(func).parameters.keys()
+        self._hasRequestArgs = hasRequestArgs(func)
+
+    async def __call__(self, request):
+        kw = {}
+        if len(self._requiredArgs) > 0:
+            if request.method == 'GET':
+                qs = request.query_string
+                if qs:
+                    for k, v in parse.parse_qs(qs, True).items():
+                        kw[k] = v
+        for name, value in request.match_info.items():
+            if name in self._requiredArgs:
+                kw[name] = value
+        if self._hasRequestArgs:
+            kw['request'] = request
+        for key in self._requiredArgs:
+            if not key in kw:
+                return web.HTTPBadRequest()
+        args = {}
+        for key in kw:
+            if key in self._requiredArgs:
+                args[key] = kw[key]
+        return await self._func(**args)
+
+
+class FakeRequest():
+    def __init__(self, match_info, query_string):
+        self.method = 'GET'
+        self.match_info = match_info
+        self.query_string = query_string
+        self.query = MultiDictProxy(MultiDict(parse.parse_qsl(query_string, True)))
+
+
+async def blog(*, id, page, request):
+    return id
+
+
+async def run(handler, request, n):
+    start = time.perf_counter()
+    for i in range(n):
+        await handler(request)
+    return round((time.perf_counter() - start) / n * 1e6, 3)
+
+
+def main(n=100000):
+    request = FakeRequest({'id': '42'}, 'page=3&ref=home')
+    loop = asyncio.new_event_loop()
+    result = {
+        'calls': n,
+        'legacy_us_per_call': loop.run_until_complete(run(LegacyRequestHandler(blog), request, n)),
+        'binder_us_per_call': loop.run_until_complete(run(RequestHandler(blog), request, n))
+    }
+    loop.close()
+    print(json.dumps(result, indent=2))
+    return result
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+# python -m bench.load [--articles N] [--categories N] [--requests N] [--concurrency N] [--output FILE]
+import os, sys, json, time, shutil, signal, random, resource, argparse, asyncio, logging, tempfile, subprocess, multiprocessing
+import aiohttp
+from bench import sqlitedb
+
+ROUTES = ['/', '/category', '/blog/{id}.html']
+
+
+def serve(path, port, cache, ready):
+    import index
+    index.config['logging']['level'] = 'WARNING'
+    if not cache:
+        index.config['page_cache']['maxsize'] = 0
+    index.config['search']['path'] = path + '.idx'
+    sqlitedb.install(path)
+    loop = index.new_loop()
+    loop.run_until_complete(index.init(loop, '127.0.0.1', port))
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    ready.set()
+    loop.run_until_complete(stopping.wait())
+    loop.close()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 3)
+
+
+async def drive(base, articles, total, concurrency, seed):
+    rnd = random.Random(seed)
+    urls = [rnd.choice(ROUTES).format(id=rnd.randint(1, articles)) for i in range(total)]
+    latency = {route: [] for route in ROUTES}
+    errors = []
+    async def worker(session):
+        while urls:
+            url = urls.pop()
+            route = url if url in latency else ROUTES[2]
+            start = time.perf_counter()
+            try:
+                async with session.get(base + url) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors.append(resp.status)
+                        continue
+            except aiohttp.ClientError as e:
+                errors.append(type(e).__name__)
+                continue
+            latency[route].append(time.perf_counter() - start)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latency, errors, elapsed
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(options):
+    scratch = None if options.db else tempfile.mkdtemp()
+    path = options.db or os.path.join(scratch, 'bench.db')
+    sqlitedb.seed(path, options.articles, options.categories)
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(path, options.port, options.cache, ready))
+    server.start()
+    if not ready.wait(60):
+        server.terminate()
+        raise SystemExit('server did not start')
+    loop = asyncio.new_event_loop()
+    base = 'http://127.0.0.1:{}'.format(options.port)
+    try:
+        if options.warmup:
+            loop.run_until_complete(drive(base, options.articles, options.warmup, options.concurrency, options.seed + 1))
+        latency, errors, elapsed = loop.run_until_complete(
+            drive(base, options.articles, options.requests, options.concurrency, options.seed))
+    finally:
+        loop.close()
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(10)
+    done = sum(len(v) for v in latency.values())
+    everything = [x for v in latency.values() for x in v]
+    result = {
+        'revision': revision(),
+        'python': sys.version.split()[0],
+        'articles': options.articles,
+        'categories': options.categories,
+        'concurrency': options.concurrency,
+        'page_cache': options.cache,
+        'requests': done,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'rps': round(done / elapsed, 1) if elapsed else None,
+        'p50_ms': percentile(everything, 0.5),
+        'p99_ms': percentile(everything, 0.99),
+        'routes': {route: {'requests': len(v), 'p50_ms': percentile(v, 0.5), 'p99_ms': percentile(v, 0.99)}
+                   for route, v in latency.items()},
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        'server_maxrss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // (1024 if sys.platform == 'darwin' else 1),
+        'client_maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+    }
+    output = json.dumps(result, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    print(output)
+    if scratch is not None:
+        # the database, the search index and its journal and lock files
+        shutil.rmtree(scratch, ignore_errors=True)
+    return result
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--articles', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=2017)
+    parser.add_argument('--db', help='keep the seeded SQLite database at this path')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='disable the page cache')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    main(parser.parse_args())
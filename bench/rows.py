@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+# python -m bench.rows [rows]
+import sys, time, tracemalloc, json
+from Model.Article import Article
+
+
+class LegacyRow(dict):
+    # result row as built before Model.__row__: a dict carrying the builder lists
+    def __init__(self, **kw):
+        super(LegacyRow, self).__init__(**kw)
+        self.__where__ = []
+        self.__args__ = []
+        self.__select__ = []
+        self.__limit__ = []
+        self.__orderBy__ = []
+        self.__update__ = []
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+def make_rows(n):
+    return [{
+        'id': i,
+        'title': 'title {}'.format(i),
+        'content': '',
+        'catid': i % 8,
+        'tag': 'python',
+        'description': 'description of article {}'.format(i),
+        'created_at': 1500000000 + i,
+        'comment_count': 0,
+        'view_count': i
+    } for i in range(n)]
+
+
+def measure(build, rs):
+    start = time.perf_counter()
+    build(rs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    objs = build(rs)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return {'seconds': round(elapsed, 4), 'us_per_row': round(elapsed / len(rs) * 1e6, 3), 'bytes_per_row': size // len(rs)}
+
+
+def main(n=100000):
+    rs = make_rows(n)
+    load = Article.__row__.load
+    result = {
+        'rows': n,
+        'legacy': measure(lambda rs: [LegacyRow(**r) for r in rs], rs),
+        'slotted': measure(lambda rs: [load(r) for r in rs], rs)
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
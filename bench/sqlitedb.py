@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+# SQLite stand-in for the aiomysql pool used by orm, for benchmarks without MySQL.
+# Queries run synchronously on the event loop; SQLite answers in microseconds.
+import sqlite3, asyncio, random, time, re
+import orm
+
+TYPES = (('int', 'INTEGER'), ('float', 'REAL'), ('boolean', 'INTEGER'))
+
+def column_type(field):
+    t = field.column_type.lower()
+    for prefix, sqlite in TYPES:
+        if t.startswith(prefix) or t.endswith(prefix):
+            return sqlite
+    return 'TEXT'
+
+def create_table(db, model):
+    columns = []
+    for name in model.__fields__:
+        field = model.__mappings__[name]
+        if field.primary_key:
+            columns.append('`{}` INTEGER PRIMARY KEY'.format(name))
+        else:
+            columns.append('`{}` {}'.format(name, column_type(field)))
+    db.execute('DROP TABLE IF EXISTS `{}`'.format(model.__table__))
+    db.execute('CREATE TABLE `{}` ({})'.format(model.__table__, ','.join(columns)))
+    pk = model.__primary_key__
+    if pk:
+        # MySQL hands out the next auto-increment id when 0 is inserted
+        db.execute('CREATE TRIGGER `{0}_auto_id` AFTER INSERT ON `{0}` WHEN NEW.`{1}` = 0 BEGIN '
+                   'UPDATE `{0}` SET `{1}` = (SELECT MAX(`{1}`) + 1 FROM `{0}`) WHERE `{1}` = 0; END'.format(model.__table__, pk))
+
+
+INSERT = re.compile(r'^\s*insert\s+into\s+`?(\w+)`?', re.I)
+
+class Cursor():
+    def __init__(self, conn):
+        self.connection = conn
+        self._cur = conn._db.cursor()
+        self._names = None
+        self._lastrowid = None
+        self._rowcounts = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def rowcount(self):
+        return self._rowcounts[0] if self._rowcounts else -1
+
+    @property
+    def lastrowid(self):
+        return self._lastrowid
+
+    async def execute(self, sql, args=()):
+        # multi-statement batches are split on ';' and run one after another, like the MySQL protocol does
+        args = list(args or ())
+        self._rowcounts = []
+        for part in sql.split(';'):
+            n = part.count('%s')
+            params, args = args[:n], args[n:]
+            self._cur.execute(part.replace('%s', '?'), params)
+            self._rowcounts.append(self._cur.rowcount)
+            self._lastrowid = self._cur.lastrowid
+            m = INSERT.match(part)
+            if m and self._lastrowid == 0:
+                self._lastrowid = self._cur.connection.execute('SELECT MAX(rowid) FROM `{}`'.format(m.group(1))).fetchone()[0]
+        self._names = [d[0] for d in self._cur.description] if self._cur.description else None
+        return self.rowcount
+
+    def _rows(self, rows):
+        return [dict(zip(self._names, r)) for r in rows]
+
+    async def fetchall(self):
+        return self._rows(self._cur.fetchall()) if self._names else []
+
+    async def fetchmany(self, size):
+        return self._rows(self._cur.fetchmany(size)) if self._names else []
+
+    async def nextset(self):
+        if len(self._rowcounts) > 1:
+            self._rowcounts.pop(0)
+            return True
+        return None
+
+    async def close(self):
+        self._cur.close()
+
+
+class Connection():
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self.closed = False
+
+    def cursor(self, cls=None):
+        return Cursor(self)
+
+    async def begin(self):
+        self._db.execute('BEGIN')
+
+    async def commit(self):
+        self._db.execute('COMMIT')
+
+    async def rollback(self):
+        if self._db.in_transaction:
+            self._db.execute('ROLLBACK')
+
+    async def ping(self, reconnect=False):
+        self._db.execute('SELECT 1')
+
+    def close(self):
+        if not self.closed:
+            self._db.close()
+            self.closed = True
+
+
+class Pool():
+    def __init__(self, path, minsize=1, maxsize=10):
+        self._path = path
+        self.minsize = minsize
+        self._maxsize = maxsize
+        self._free = []
+        self._used = set()
+        self._cond = asyncio.Condition()
+        self._closing = False
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def size(self):
+        return len(self._free) + len(self._used)
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    async def acquire(self):
+        async with self._cond:
+            while not self._free and self.size >= self._maxsize:
+                await self._cond.wait()
+            conn = self._free.pop() if self._free else Connection(self._path)
+            self._used.add(conn)
+            return conn
+
+    async def _wakeup(self):
+        async with self._cond:
+            self._cond.notify()
+
+    def release(self, conn):
+        self._used.discard(conn)
+        if not conn.closed:
+            if self._closing:
+                conn.close()
+            else:
+                self._free.append(conn)
+        return asyncio.ensure_future(self._wakeup())
+
+    def close(self):
+        self._closing = True
+        for conn in self._free:
+            conn.close()
+        self._free = []
+
+    async def wait_closed(self):
+        pass
+
+
+def install(path):
+    async def create(loop, kw):
+        maxsize = kw.get('maxsize', 10)
+        minsize = kw.get('minsize', 1)
+        upper = kw.get('upper', maxsize * 2)
+        return orm.ManagedPool(Pool(path, minsize, upper), max(minsize, 1), upper, maxsize,
+                               ping_after=kw.get('ping_after', 30), adapt_interval=kw.get('adapt_interval', 10))
+    orm._create_pool = create
+
+
+WORDS = ['异步', '编程', '数据库', '缓存', '索引', '性能', 'python', 'mysql', 'aiohttp', 'jinja2', '模板', '并发', '连接池', '分页']
+
+def seed(path, articles=1000, categories=10, seed=2017):
+    from Model.Article import Article
+    from Model.Category import Category
+    from Model.User import User
+    rnd = random.Random(seed)
+    db = sqlite3.connect(path)
+    for model in (Article, Category, User):
+        create_table(db, model)
+    db.executemany('INSERT INTO `Category` (`id`,`name`,`article_count`,`pid`) VALUES (?,?,?,?)',
+                   [(i, '分类{}'.format(i), 0, 0) for i in range(1, categories + 1)])
+    rows = []
+    now = int(time.time())
+    for i in range(1, articles + 1):
+        content = ''.join('<p>{}</p>'.format(' '.join(rnd.choice(WORDS) for w in range(40))) for p in range(20))
+        a = Article(id=i, title='文章 {} {}'.format(i, rnd.choice(WORDS)), content=content, catid=rnd.randint(1, categories),
+                    tag=rnd.choice(WORDS), description='', created_at=now - i * 60, comment_count=0, view_count=rnd.randint(0, 1000))
+        a.beforeSave()
+        rows.append(tuple(a.getValueOrDefault(f) for f in Article.__fields__))
+    db.executemany('INSERT INTO `Article` ({}) VALUES ({})'.format(','.join('`{}`'.format(f) for f in Article.__fields__),
+                                                                  ','.join('?' * len(Article.__fields__))), rows)
+    db.commit()
+    db.close()
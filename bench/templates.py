@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+# python -m bench.templates [renders]
+import sys, time, json, tempfile, shutil
+from index import init_jinja2, compile_templates
+from bench.rows import make_rows
+from Model.Article import Article
+
+
+def startup(**kw):
+    start = time.perf_counter()
+    app = {}
+    init_jinja2(app, **kw)
+    app['__template__'].get_template('index.html')
+    return app['__template__'], round((time.perf_counter() - start) * 1000, 3)
+
+
+def render(env, n):
+    load = Article.__row__.load
+    articles = [load(r) for r in make_rows(20)]
+    start = time.perf_counter()
+    for i in range(n):
+        env.get_template('index.html').render(articles=articles, next=None)
+    return round((time.perf_counter() - start) / n * 1e6, 3)
+
+
+def main(n=2000):
+    tmp = tempfile.mkdtemp()
+    try:
+        compiled = tmp + '/compiled'
+        compile_templates(compiled)
+        modes = {
+            'development': {},
+            'production': {'production': True, 'cache_dir': tmp + '/bytecode'},
+            'precompiled': {'production': True, 'compiled': compiled}
+        }
+        result = {'renders': n}
+        for name, kw in modes.items():
+            startup(**kw)
+            env, ms = startup(**kw)
+            result[name] = {'startup_ms': ms, 'us_per_render': render(env, n)}
+    finally:
+        shutil.rmtree(tmp)
+    print(json.dumps(result, indent=2))
+    return result
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import gzip, zlib, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from assets import acceptEncodings
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HAS_BROTLI = brotli is not None
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+def negotiate(accepted, available):
+    for e in ('br', 'gzip', 'deflate'):
+        if e in available and e in accepted:
+            return e
+    return 'identity'
+
+def variantTag(etag, encoding):
+    if etag is None or encoding == 'identity':
+        return etag
+    return '{}-{}"'.format(etag[:-1], encoding) if etag.endswith('"') else '{}-{}'.format(etag, encoding)
+
+def addVary(headers):
+    vary = headers.get('Vary')
+    if vary is None:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['Vary'] = vary + ', Accept-Encoding'
+
+
+class Compressor():
+    def __init__(self, min_size=1024, offload_size=65536, gzip_level=6, brotli=True, brotli_quality=5, workers=2):
+        self._minSize = min_size
+        self._offloadSize = offload_size
+        self._gzipLevel = gzip_level
+        self._brotliQuality = brotli_quality
+        self.encodings = ('br', 'gzip', 'deflate') if brotli and HAS_BROTLI else ('gzip', 'deflate')
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._stats = {'compressed': 0, 'offloaded': 0, 'skipped': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def encode(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self._brotliQuality)
+        if encoding == 'gzip':
+            return gzip.compress(body, self._gzipLevel)
+        return zlib.compress(body, self._gzipLevel)
+
+    def choose(self, request):
+        return negotiate(acceptEncodings(request.headers.get('Accept-Encoding')), self.encodings)
+
+    def compressible(self, resp):
+        if type(resp) is not web.Response or resp.prepared or resp.status != 200:
+            return False
+        if 'Content-Encoding' in resp.headers or 'no-transform' in resp.headers.get('Cache-Control', ''):
+            return False
+        body = resp.body
+        if not isinstance(body, (bytes, bytearray)) or len(body) < self._minSize:
+            return False
+        return (resp.content_type or '').startswith(COMPRESSIBLE)
+
+    async def compress(self, request, resp):
+        if not self.compressible(resp):
+            self._stats['skipped'] += 1
+            return resp
+        encoding = self.choose(request)
+        addVary(resp.headers)
+        if encoding == 'identity':
+            return resp
+        page = request.get('__page__')
+        body = resp.body
+        data = page.variants.get(encoding) if page is not None else None
+        if data is None:
+            if len(body) >= self._offloadSize:
+                self._stats['offloaded'] += 1
+                data = await asyncio.get_event_loop().run_in_executor(self._executor, self.encode, body, encoding)
+            else:
+                data = self.encode(body, encoding)
+            if page is not None:
+                page.variants[encoding] = data
+        self._stats['compressed'] += 1
+        self._stats['bytes_in'] += len(body)
+        self._stats['bytes_out'] += len(data)
+        resp.body = data
+        resp.headers['Content-Encoding'] = encoding
+        if 'ETag' in resp.headers:
+            resp.headers['ETag'] = variantTag(resp.headers['ETag'], encoding)
+        return resp
+
+    def enable(self, request, resp):
+        # streamed bodies are compressed chunk by chunk by aiohttp itself
+        encoding = self.choose(request)
+        if encoding in ('gzip', 'deflate'):
+            resp.enable_compression(web.ContentCoding.gzip if encoding == 'gzip' else web.ContentCoding.deflate)
+            addVary(resp.headers)
+
+    def stats(self):
+        return dict(self._stats)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
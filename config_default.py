@@ -2,11 +2,76 @@
 __author__ = 'Ernie Peng'
 
 config = {
+    'server' : {
+        'host' : '127.0.0.1',
+        'port' : 2333,
+        'workers' : 1,
+        'db_connections' : 10,
+        'uvloop' : False,
+        'grace' : 30
+    },
     'db' : {
         'host' : '127.0.0.1',
         'port' : 3306,
         'user' : 'root',
         'password' : '',
-        'database' : 'test'
+        'database' : 'test',
+        'prepare' : False,
+        'coalesce' : True,
+        'replicas' : [],
+        'balance' : 'round_robin',
+        'sticky' : 2
+    },
+    'logging' : {
+        'level' : 'INFO',
+        'json' : False,
+        'sample_rate' : 0.01,
+        'slow_query' : 0.1,
+        'explain' : True,
+        'server_timing' : False
+    },
+    'jinja2' : {
+        'production' : False,
+        'cache_dir' : None,
+        'compiled' : None
+    },
+    'static' : {
+        'build' : None,
+        'brotli' : True,
+        'level' : 9
+    },
+    'search' : {
+        'path' : None,
+        'persist_every' : 200
+    },
+    'json' : {
+        'encoder' : 'auto',
+        'chunk_size' : 65536
+    },
+    'compress' : {
+        'enabled' : True,
+        'min_size' : 1024,
+        'offload_size' : 65536,
+        'gzip_level' : 6,
+        'brotli' : True,
+        'brotli_quality' : 5,
+        'workers' : 2
+    },
+    'export' : {
+        'routes' : ['/', '/category'],
+        'article' : '/blog/{id}.html',
+        'concurrency' : 16
+    },
+    'schema' : {
+        'advisor' : True,
+        'maxsize' : 500
+    },
+    'page_cache' : {
+        'ttl' : 60,
+        'maxsize' : 512
+    },
+    'internals' : {
+        'enabled' : False,
+        'token' : None
     }
 }
\ No newline at end of file
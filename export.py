@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import os, json, gzip, hashlib, logging, asyncio, time
+import aiohttp
+import orm, jsonify
+from Model.Article import Article
+from Model.Category import Category
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'export.json'
+
+def fileFor(path):
+    path = path.lstrip('/')
+    if path == '' or path.endswith('/'):
+        return path + 'index.html'
+    if path.endswith('.html'):
+        return path
+    return path + '/index.html'
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def remove(path):
+    for name in (path, path + '.gz', path + '.br'):
+        if os.path.exists(name):
+            os.remove(name)
+
+def templateDigest(path):
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in sorted(os.walk(path)):
+        for filename in sorted(filenames):
+            with open(os.path.join(dirpath, filename), 'rb') as f:
+                digest.update(filename.encode('utf-8'))
+                digest.update(f.read())
+    return digest.hexdigest()
+
+async def rowChecksums(model, columns):
+    # only what the pages render, write-behind counters would mark every viewed row as changed
+    checksums = dict()
+    pk = model.__primary_key__
+    columns = [pk] + [c for c in columns if c != pk]
+    async for rs in model.find().choose(*('`{}`'.format(c) for c in columns)).stream(batch_size=500, raw=True):
+        for r in rs:
+            checksums[r[pk]] = hashlib.sha1(jsonify.dumps([r[c] for c in columns])).hexdigest()
+    return checksums
+
+
+class Exporter():
+    def __init__(self, app, output, templates, routes=('/', '/category'), article='/blog/{id}.html', concurrency=16, level=9, brotli=True,
+                 article_columns=('title', 'catid', 'tag', 'description', 'content', 'created_at'),
+                 listing_columns=('title', 'catid', 'description'), category_columns=('name', 'pid')):
+        self.app = app
+        self.output = output
+        self.templates = templates
+        self.routes = list(routes)
+        self.article = article
+        self.columns = {'article': article_columns, 'listing': listing_columns, 'category': category_columns}
+        self._concurrency = concurrency
+        self._level = level
+        self._brotli = brotli
+        self.stats = {'rendered': 0, 'skipped': 0, 'removed': 0, 'failed': 0}
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.output, MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'build': None, 'pages': {}}
+
+    async def plan(self):
+        articles = await rowChecksums(Article, self.columns['article'])
+        listed = await rowChecksums(Article, self.columns['listing'])
+        categories = await rowChecksums(Category, self.columns['category'])
+        # listings depend on every row, pages on their own row
+        listing = hashlib.sha1(json.dumps([sorted(listed.items()), sorted(categories.items())]).encode('utf-8')).hexdigest()
+        pages = dict((route, listing) for route in self.routes)
+        for pk, checksum in articles.items():
+            pages[self.article.format(id=pk)] = checksum
+        return pages
+
+    def _save(self, path, body):
+        target = os.path.join(self.output, fileFor(path))
+        write(target, body)
+        write(target + '.gz', gzip.compress(body, self._level))
+        if brotli is not None and self._brotli:
+            write(target + '.br', brotli.compress(body))
+
+    async def _render(self, session, base, path, semaphore):
+        async with semaphore:
+            try:
+                async with session.get(base + path, headers={'Accept-Encoding': 'identity'}) as resp:
+                    body = await resp.read()
+                    if resp.status != 200:
+                        raise ValueError('status {}'.format(resp.status))
+            except (aiohttp.ClientError, ValueError) as e:
+                logging.warning("export {} failed: {}".format(path, e))
+                self.stats['failed'] += 1
+                return False
+        await asyncio.get_event_loop().run_in_executor(None, self._save, path, body)
+        self.stats['rendered'] += 1
+        return True
+
+    async def run(self, loop, full=False):
+        start = time.perf_counter()
+        manifest = self._load()
+        build = templateDigest(self.templates)
+        if manifest.get('build') != build:
+            full = True
+        pages = await self.plan()
+        old = manifest.get('pages', {})
+        todo = [path for path, checksum in pages.items() if full or old.get(path) != checksum]
+        self.stats['skipped'] = len(pages) - len(todo)
+        for path in set(old) - set(pages):
+            remove(os.path.join(self.output, fileFor(path)))
+            self.stats['removed'] += 1
+        # export requests are not page views
+        orm.suspend_counters()
+        # a static host cannot serve ?after= links, listings are rendered whole
+        self.app['__export__'] = True
+        handler = self.app.make_handler()
+        srv = await loop.create_server(handler, '127.0.0.1', 0)
+        base = 'http://127.0.0.1:{}'.format(srv.sockets[0].getsockname()[1])
+        semaphore = asyncio.Semaphore(self._concurrency)
+        try:
+            async with aiohttp.ClientSession() as session:
+                done = await asyncio.gather(*[self._render(session, base, path, semaphore) for path in todo])
+        finally:
+            srv.close()
+            await srv.wait_closed()
+            await handler.shutdown(1)
+        for path, ok in zip(todo, done):
+            if not ok:
+                pages.pop(path)
+        if '__assets__' in self.app:
+            self.app['__assets__'].export(os.path.join(self.output, 'static'))
+        write(os.path.join(self.output, MANIFEST), json.dumps({'build': build, 'pages': pages}, indent=2, sort_keys=True).encode('utf-8'))
+        logging.info("exported {rendered} pages, {skipped} unchanged, {removed} removed, {failed} failed".format(**self.stats)
+                     + " in {:.1f}s".format(time.perf_counter() - start))
+        return self.stats
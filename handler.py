@@ -1,26 +1,102 @@
 from webframe import get
 from aiohttp import web
+import json, hmac
+import orm, profiler
+from jsonify import JsonStream
 from Model.User import User
 from Model.Article import  Article
 from Model.Category import Category
 import logging;logging.basicConfig(level=logging.INFO)
 
 @get('/blog/{id}.html')
-def blog(*, id, request):
-    return web.Response(content_type='text/html', body=bytes(id, encoding='utf8'))
+def blog(*, id: int):
+    Article.counter.incr(id, 'view_count')
+    return web.Response(content_type='text/html', body=bytes(str(id), encoding='utf8'))
+
+def pageSize(request, size):
+    # exported listings hold every row, see Exporter.run
+    return None if request.app.get('__export__') else size
 
 @get('/')
-async def index():
-    articles = await Article().find().all()
+async def index(*, after: str = None, request):
+    try:
+        articles, next_cursor = await Article().find().cached(ttl=60).prefetch('category').paginate(after=after, order_by=['id', 'desc'], page_size=pageSize(request, 10))
+    except ValueError:
+        return web.HTTPBadRequest()
     return {
         '__template__' : 'index',
-        'articles' : articles
+        'articles' : articles,
+        'next' : next_cursor
     }
 
 @get('/category')
-async def category():
-    category = await Category().find().all()
+async def category(*, after: str = None, request):
+    try:
+        category, next_cursor = await Category().find().cached(ttl=60).paginate(after=after, page_size=pageSize(request, 20))
+    except ValueError:
+        return web.HTTPBadRequest()
     return {
         '__template__' : 'category',
-        'category' : category
-    }
\ No newline at end of file
+        'category' : category,
+        'next' : next_cursor
+    }
+
+@get('/search')
+async def search(*, q: str = '', page: int = 1, request):
+    page = max(page, 1)
+    total, hits = request.app['__search__'].search(q, page, 10) if q.strip() else (0, [])
+    articles = []
+    if hits:
+        rows = await Article().find().where(['id', [pk for pk, score in hits], 'in']).prefetch('category').all() or []
+        byId = dict((row.id, row) for row in rows)
+        articles = [byId[pk] for pk, score in hits if pk in byId]
+    return {
+        '__template__' : 'search',
+        'q' : q,
+        'page' : page,
+        'total' : total,
+        'articles' : articles,
+        'more' : page * 10 < total
+    }
+
+@get('/api/articles')
+def api_articles(*, catid: int = 0):
+    query = Article().find()
+    if catid:
+        query.where(['catid', catid])
+    return JsonStream(query.orderBy(['`id`', 'desc']).stream(batch_size=500, raw=True))
+
+def internals(request):
+    # behind a local reverse proxy every client is loopback, so require the flag and token
+    settings = request.app.get('__internals__') or {}
+    if not settings.get('enabled'):
+        return web.HTTPNotFound()
+    token = settings.get('token')
+    if not token or not hmac.compare_digest(request.headers.get('X-Internals-Token', ''), token):
+        return web.HTTPForbidden()
+    return None
+
+@get('/__metrics')
+def metrics(*, request):
+    denied = internals(request)
+    if denied is not None:
+        return denied
+    rs = orm.metrics()
+    cache = request.app.get('__pagecache__')
+    if cache is not None:
+        rs['page_cache'] = cache.stats()
+    compressor = request.app.get('__compress__')
+    if compressor is not None:
+        rs['compress'] = compressor.stats()
+    rs['routes'] = profiler.stats()
+    return web.Response(body=json.dumps(rs, indent=2).encode('utf-8'), content_type='application/json')
+
+@get('/__indexes')
+async def indexes(*, request):
+    denied = internals(request)
+    if denied is not None:
+        return denied
+    advisor = request.app.get('__advisor__')
+    if advisor is None:
+        return web.HTTPNotFound()
+    return await advisor.report()
\ No newline at end of file
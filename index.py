@@ -2,66 +2,285 @@
 __author__ = 'Ernie Peng'
 
 import logging;logging.basicConfig(level=logging.INFO)
-import asyncio, os, json, time
+import asyncio, os, sys, time, argparse, signal
 from aiohttp import web
-from jinja2 import Environment, FileSystemLoader
+from markupsafe import Markup
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, ModuleLoader, ChoiceLoader
 from my_config import config
 
-import orm
-from webframe import add_static, add_routes
+import orm, profiler, jsonify, schema
+from search import init_search
+from Model.Article import Article
+from Model.Category import Category
+from Model.User import User
+from pagecache import PageCache
+from compress import Compressor
+from prefork import Supervisor
+from export import Exporter
+from tool import sanitize_html
+from webframe import add_static, add_routes, create_assets
 
 def init_jinja2(app, **kw):
     logging.info("init jinja2...")
+    production = kw.get('production', False)
     option = {
         'autoescape' : kw.get('autoescape', True),
         'block_start_string' : kw.get("block_start_string", '<?python'),
         'block_end_string' : kw.get('block_end_string', '?>'),
         'variable_start_string' : kw.get("variable_start_string", "<?="),
         'variable_end_string' : kw.get("variable_end_string", '=?>'),
-        'auto_reload' : kw.get("auto_reload", True)
+        'auto_reload' : kw.get("auto_reload", not production)
     }
     path = kw.get('path', None)
     if path is None:
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
     logging.info("set jinja2 template path :{}".format(path))
-    env = Environment(loader=FileSystemLoader(path), **option)
+    source = loader = FileSystemLoader(path)
+    compiled = kw.get('compiled', None)
+    if compiled is not None and os.path.isdir(compiled):
+        logging.info("use precompiled templates :{}".format(compiled))
+        loader = ChoiceLoader([ModuleLoader(compiled), loader])
+    cache_dir = kw.get('cache_dir', None)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        option['bytecode_cache'] = FileSystemBytecodeCache(cache_dir)
+    env = Environment(loader=loader, **option)
+    env.globals['static_url'] = lambda name: '/static/' + name.lstrip('/')
+    env.filters['sanitize'] = lambda html: Markup(sanitize_html(html or ''))
     filter = kw.get('filter', None)
     if filter is not None:
         for name, value in filter.items():
             env.filters[name] = value
+    if production:
+        start = time.perf_counter()
+        names = [name for name in source.list_templates() if name.endswith('.html')]
+        for name in names:
+            env.get_template(name)
+        logging.info("precompiled {} templates in {:.1f}ms".format(len(names), (time.perf_counter() - start) * 1000))
     app['__template__'] = env
 
+def compile_templates(target, **kw):
+    env = {}
+    init_jinja2(env, **dict(kw, compiled=None, production=False))
+    env['__template__'].compile_templates(target, zip=None, filter_func=lambda name: name.endswith('.html'))
+    logging.info("compiled templates into {}".format(target))
+
+async def streamTemplate(request, template, rs, chunk_size=8192):
+    resp = web.StreamResponse()
+    resp.content_type = 'text/html'
+    resp.charset = 'utf-8'
+    if '__compress__' in request.app:
+        request.app['__compress__'].enable(request, resp)
+    await resp.prepare(request)
+    buf = []
+    size = 0
+    for part in template.generate(**rs):
+        buf.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            await resp.write(''.join(buf).encode('utf-8'))
+            buf = []
+            size = 0
+    if buf:
+        await resp.write(''.join(buf).encode('utf-8'))
+    await resp.write_eof()
+    return resp
+
+def routeName(request):
+    resource = getattr(request.match_info.route, 'resource', None)
+    return getattr(resource, 'canonical', None) or request.path
+
+async def profileFactory(app, handler):
+    async def profile(request):
+        p = profiler.start(routeName(request))
+        resp = await handler(request)
+        if p is not None and resp is not None:
+            if profiler.settings['server_timing'] and not resp.prepared:
+                resp.headers.update(p.headers())
+            p.finish(resp.status)
+        return resp
+    return profile
+
+async def compressFactory(app, handler):
+    async def compress(request):
+        resp = await handler(request)
+        compressor = app.get('__compress__')
+        if compressor is None or resp is None:
+            return resp
+        start = time.perf_counter()
+        resp = await compressor.compress(request, resp)
+        profiler.record('compress', time.perf_counter() - start)
+        return resp
+    return compress
+
 async def responseFactory(app, handler):
     async def response(request):
-        logging.info("response handler..")
+        logging.debug("response handler..")
+        cache = app.get('__pagecache__')
+        key = cache.key(request) if cache is not None else None
+        if key is not None:
+            page = cache.get(key)
+            if page is not None:
+                return cache.respond(page, request)
+        tables = orm.track_reads()
+        start = time.perf_counter()
         rs = await handler(request)
+        profiler.record('handler', time.perf_counter() - start)
         if isinstance(rs, web.StreamResponse):
             return rs
+        if isinstance(rs, jsonify.JsonStream):
+            return await rs.respond(request)
         if isinstance(rs, bytes):
             return web.Response(body=rs,content_type="application/octet-stream")
         if isinstance(rs, str):
             if rs.startswith("redirect:"):
                 return web.HTTPFound(rs[9:])
             return web.Response(body=bytes(rs,encoding='utf8'),content_type="text/html",charset='utf8')
+        if isinstance(rs, list):
+            return jsonify.response(rs)
         if isinstance(rs, dict):
-            if rs['__template__'] is not None:
-                return web.Response(body=app['__template__'].get_template(rs['__template__'] + '.html').render(**rs).encode('utf-8'), content_type='text/html')
+            if rs.get('__template__') is not None:
+                template = app['__template__'].get_template(rs['__template__'] + '.html')
+                if rs.get('__stream__', False):
+                    return await streamTemplate(request, template, rs)
+                start = time.perf_counter()
+                body = template.render(**rs).encode('utf-8')
+                profiler.record('render', time.perf_counter() - start)
+                if key is not None:
+                    return cache.respond(cache.set(key, body, 'text/html', 'utf-8', tables), request)
+                return web.Response(body=body, content_type='text/html')
             else:
-                return web.Response(body=json.dump(rs, ensure_ascii=False, default=lambda o:o.__dict__).encode('utf8'), content_type="text/html", charset='utf8')
+                rs = dict((k, v) for k, v in rs.items() if k not in ('__template__', '__stream__'))
+                body = jsonify.dumps(rs)
+                if key is not None:
+                    return cache.respond(cache.set(key, body, 'application/json', 'utf-8', tables), request)
+                return jsonify.response(rs)
     return response
 
-async def init(loop):
-    await orm.create_pool(loop, **config['db'])
+async def create_app(loop, db=None, prebuilt=False):
+    profiler.setup_logging(**config['logging'])
+    jsonify.setup(**config['json'])
+    await orm.create_pool(loop, **(db or config['db']))
     app = web.Application(loop=loop, middlewares=[
+        profileFactory,
+        compressFactory,
         responseFactory
     ])
-    init_jinja2(app)
+    init_jinja2(app, **config['jinja2'])
+    app['__pagecache__'] = PageCache(**config['page_cache'])
+    app['__internals__'] = config['internals']
+    if config['schema']['advisor']:
+        app['__advisor__'] = schema.Advisor(config['schema']['maxsize'])
+        orm.set_advisor(app['__advisor__'])
+    if config['compress']['enabled']:
+        app['__compress__'] = Compressor(**dict((k, v) for k, v in config['compress'].items() if k != 'enabled'))
+        app.on_cleanup.append(close_compress)
     add_routes(app, 'handler')
-    add_static(app)
-    srv = await loop.create_server(app.make_handler(), '127.0.0.1', 2333)
-    logging.info("start at 127.0.0.1:2333")
+    add_static(app, prebuilt, **config['static'])
+    app['__search__'] = await init_search(Article, **config['search'])
+    app.on_cleanup.append(close_search)
+    return app
+
+async def close_compress(app):
+    app['__compress__'].close()
+
+async def close_search(app):
+    await app['__search__'].flush()
+    app['__search__'].close()
+
+async def init(loop, host=None, port=None):
+    host = host or config['server']['host']
+    port = port or config['server']['port']
+    app = await create_app(loop)
+    srv = await loop.create_server(app.make_handler(), host, port)
+    logging.info("start at {}:{}".format(host, port))
     return srv
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
\ No newline at end of file
+def export_site(output, full=False):
+    loop = new_loop()
+    app = loop.run_until_complete(create_app(loop))
+    templates = config['jinja2'].get('path', None) or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    exporter = Exporter(app, output, templates, level=config['static']['level'], brotli=config['static']['brotli'], **config['export'])
+    loop.run_until_complete(exporter.run(loop, full))
+    loop.run_until_complete(app.cleanup())
+    loop.run_until_complete(orm.close_pool())
+    loop.close()
+
+def migrate(apply=False, drop=False):
+    loop = new_loop()
+    loop.run_until_complete(orm.create_pool(loop, **config['db']))
+    try:
+        statements = loop.run_until_complete(schema.migrate([Category, Article, User], apply, drop))
+    except orm.SQLError as e:
+        logging.error("migration failed, statements before it were applied: {}".format(e))
+        statements = None
+    finally:
+        loop.run_until_complete(orm.close_pool())
+        loop.close()
+    if statements is None:
+        sys.exit(1)
+    for sql in statements:
+        print(sql + ';')
+
+def worker_pool(db, workers, budget):
+    maxsize = max(1, budget // workers)
+    # upper keeps adaptive growth inside the per-worker share of the budget
+    return dict(db, maxsize=maxsize, upper=maxsize, minsize=min(db.get('minsize', 1), maxsize))
+
+def new_loop(uvloop=False):
+    if uvloop:
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            logging.warning("uvloop is not installed, use asyncio event loop")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+def run_worker(workerId, options):
+    server = config['server']
+    loop = new_loop(options.uvloop)
+    db = worker_pool(config['db'], options.workers, server['db_connections'])
+    # the supervisor built the assets before forking
+    app = loop.run_until_complete(create_app(loop, db, prebuilt=True))
+    handler = app.make_handler()
+    srv = loop.run_until_complete(loop.create_server(handler, server['host'], server['port'], reuse_port=True))
+    logging.info("worker {} pid {} start at {}:{}".format(workerId, os.getpid(), server['host'], server['port']))
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    loop.run_until_complete(stopping.wait())
+    logging.info("worker {} draining".format(workerId))
+    srv.close()
+    loop.run_until_complete(srv.wait_closed())
+    loop.run_until_complete(app.shutdown())
+    loop.run_until_complete(handler.shutdown(server['grace']))
+    loop.run_until_complete(app.cleanup())
+    loop.run_until_complete(orm.close_pool())
+    loop.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--compile-templates', metavar='DIR', help='precompile templates into DIR and exit')
+    parser.add_argument('--export', metavar='DIR', help='render all pages into DIR as static files and exit')
+    parser.add_argument('--full', action='store_true', help='with --export, re-render unchanged pages too')
+    parser.add_argument('--migrate', action='store_true', help='print the DDL needed to bring the database in line with the models')
+    parser.add_argument('--apply', action='store_true', help='with --migrate, run the statements')
+    parser.add_argument('--drop', action='store_true', help='with --migrate, also drop columns and indexes the models do not declare')
+    parser.add_argument('--workers', type=int, default=config['server']['workers'], help='number of worker processes')
+    parser.add_argument('--uvloop', action='store_true', default=config['server']['uvloop'], help='run workers on uvloop')
+    options = parser.parse_args()
+    if options.compile_templates:
+        compile_templates(options.compile_templates, **config['jinja2'])
+    elif options.migrate:
+        migrate(options.apply, options.drop)
+    elif options.export:
+        export_site(options.export, options.full)
+    elif options.workers > 1:
+        create_assets(**config['static'])
+        Supervisor(lambda workerId: run_worker(workerId, options), options.workers, config['server']['grace']).run()
+    else:
+        loop = new_loop(options.uvloop)
+        loop.run_until_complete(init(loop))
+        loop.run_forever()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import json, logging, datetime, decimal
+from aiohttp import web
+import orm
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def default(o):
+    if isinstance(o, orm.Row):
+        return o.toDict()
+    if isinstance(o, orm.Model):
+        return dict((f, o.get(f)) for f in o.__fields__)
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    if isinstance(o, bytes):
+        return o.decode('utf-8', 'replace')
+    raise TypeError("{} is not JSON serializable".format(type(o).__name__))
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+def orjson_dumps(obj):
+    return orjson.dumps(obj, default=default)
+
+dumps = stdlib_dumps
+CHUNK_SIZE = 65536
+
+def setup(encoder='auto', chunk_size=65536):
+    global dumps, CHUNK_SIZE
+    CHUNK_SIZE = chunk_size
+    if encoder in ('auto', 'orjson') and orjson is not None:
+        dumps = orjson_dumps
+    elif encoder == 'orjson':
+        logging.warning("orjson is not installed, use json")
+        dumps = stdlib_dumps
+    elif callable(encoder):
+        dumps = encoder
+    else:
+        dumps = stdlib_dumps
+    logging.info("json encoder: {}".format(getattr(dumps, '__name__', dumps)))
+
+def response(rs, status=200):
+    return web.Response(body=dumps(rs), status=status, content_type='application/json', charset='utf-8')
+
+
+class JsonStream():
+    # a top level JSON array written batch by batch, e.g. JsonStream(Article.find().stream(500, raw=True))
+    def __init__(self, batches, chunk_size=None):
+        self.batches = batches
+        self.chunk_size = chunk_size or CHUNK_SIZE
+
+    async def _batches(self):
+        if hasattr(self.batches, '__aiter__'):
+            async for batch in self.batches:
+                yield batch
+        else:
+            for batch in self.batches:
+                yield batch
+
+    async def respond(self, request):
+        resp = web.StreamResponse()
+        resp.content_type = 'application/json'
+        resp.charset = 'utf-8'
+        if '__compress__' in request.app:
+            request.app['__compress__'].enable(request, resp)
+        await resp.prepare(request)
+        buf = [b'[']
+        size = 1
+        first = True
+        async for batch in self._batches():
+            if not batch:
+                continue
+            # encode the whole batch at once and drop its brackets
+            body = dumps(list(batch))[1:-1]
+            if not first:
+                buf.append(b',')
+            buf.append(body)
+            size += len(body) + 1
+            first = False
+            if size >= self.chunk_size:
+                await resp.write(b''.join(buf))
+                buf = []
+                size = 0
+        buf.append(b']')
+        await resp.write(b''.join(buf))
+        await resp.write_eof()
+        return resp
@@ -1,17 +1,370 @@
 # -*- coding: utf-8 -*-
 __author__ = 'Ernie Peng'
 
-import asyncio, aiomysql
+import asyncio, aiomysql, weakref, time, sys, json, base64, contextvars, contextlib
+from collections import OrderedDict, deque
 import logging;logging.basicConfig(level=logging.WARNING)
+import profiler
 
+sqlLogger = logging.getLogger('orm.sql')
 
 def log(sql, args=()):
-    print('SQL: {}'.format(sql))
+    sqlLogger.debug('SQL: %s', sql)
 
-async def create_pool(loop, **kw):
-    logging.info("create datebase connection pool....")
-    global __pool
-    __pool = await aiomysql.create_pool(
+
+class Statement():
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.driver = sql.replace('?', '%s')
+
+    def __str__(self):
+        return self.sql
+
+
+_statements = OrderedDict()
+_statementStats = {'hits': 0, 'misses': 0, 'deallocated': 0}
+_prepare = False
+_prepared = weakref.WeakKeyDictionary()
+STATEMENT_CACHE_SIZE = 1024
+# keeps connections x this well under the server's max_prepared_stmt_count
+PREPARED_PER_CONNECTION = 256
+
+def statement(key, build=None):
+    stmt = _statements.get(key)
+    if stmt is not None:
+        _statementStats['hits'] += 1
+        _statements.move_to_end(key)
+        return stmt
+    _statementStats['misses'] += 1
+    if len(_statements) >= STATEMENT_CACHE_SIZE:
+        _statements.popitem(last=False)
+    stmt = Statement('stmt_{}'.format(_statementStats['misses']), build() if build is not None else key)
+    _statements[key] = stmt
+    return stmt
+
+def statementStats():
+    return dict(_statementStats, size=len(_statements))
+
+class Histogram():
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.BUCKETS) and value > self.BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self):
+        buckets = dict(('le_{}'.format(b), n) for b, n in zip(self.BUCKETS, self.counts))
+        buckets['le_inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 6),
+            'buckets': buckets
+        }
+
+
+_queryTime = Histogram()
+_statementCounters = dict()
+STATEMENT_COUNTERS_SIZE = 1000
+
+def _record(sql, elapsed, error=False):
+    _queryTime.observe(elapsed)
+    counter = _statementCounters.get(sql)
+    if counter is None:
+        if len(_statementCounters) >= STATEMENT_COUNTERS_SIZE:
+            return
+        counter = _statementCounters[sql] = {'count': 0, 'errors': 0, 'time': 0.0}
+    counter['count'] += 1
+    counter['time'] += elapsed
+    if error:
+        counter['errors'] += 1
+
+_explained = dict()
+EXPLAIN_INTERVAL = 300
+
+async def _explain(pool, stmt, args):
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute('EXPLAIN ' + stmt.driver, args or ())
+                return await cur.fetchall()
+    except Exception as e:
+        return 'EXPLAIN failed: {}'.format(e)
+
+async def explain(sql, args=()):
+    stmt = sql if isinstance(sql, Statement) else statement(sql)
+    return await _explain(read_pool(), stmt, args)
+
+async def _slow(stmt, args, elapsed):
+    data = {'sql': stmt.sql, 'args': list(args or ()), 'ms': round(elapsed * 1000, 3)}
+    now = time.monotonic()
+    if profiler.settings['explain'] and stmt.sql.lstrip()[:6].lower() == 'select' and now - _explained.get(stmt.sql, -EXPLAIN_INTERVAL) >= EXPLAIN_INTERVAL:
+        _explained[stmt.sql] = now
+        data['explain'] = await _explain(read_pool(), stmt, args)
+    logging.getLogger('orm.slow').warning('slow query %.2fms: %s args=%r explain=%s', elapsed * 1000, stmt.sql,
+                                          data['args'], data.get('explain'), extra={'data': data})
+
+async def _execute(cur, sql, args):
+    stmt = sql if isinstance(sql, Statement) else statement(sql)
+    start = time.monotonic()
+    try:
+        rs = await _run(cur, stmt, args)
+    except BaseException:
+        _record(stmt.sql, time.monotonic() - start, True)
+        raise
+    elapsed = time.monotonic() - start
+    _record(stmt.sql, elapsed)
+    profiler.record('sql', elapsed)
+    if elapsed >= profiler.settings['slow_query']:
+        asyncio.ensure_future(_slow(stmt, args, elapsed))
+    return rs
+
+async def _run(cur, stmt, args):
+    if not _prepare:
+        return await cur.execute(stmt.driver, args or ())
+    prepared = _prepared.get(cur.connection)
+    if prepared is None:
+        prepared = _prepared[cur.connection] = OrderedDict()
+    if stmt.name in prepared:
+        prepared.move_to_end(stmt.name)
+    else:
+        while len(prepared) >= PREPARED_PER_CONNECTION:
+            name, _ = prepared.popitem(last=False)
+            await cur.execute("DEALLOCATE PREPARE {}".format(name))
+            _statementStats['deallocated'] += 1
+        await cur.execute("PREPARE {} FROM %s".format(stmt.name), (stmt.sql,))
+        prepared[stmt.name] = True
+    if not args:
+        return await cur.execute("EXECUTE {}".format(stmt.name))
+    params = ['@{}_{}'.format(stmt.name, i) for i in range(len(args))]
+    await cur.execute("SET {}; EXECUTE {} USING {}".format(
+        ','.join('{} = %s'.format(p) for p in params), stmt.name, ','.join(params)), args)
+    await cur.nextset()
+
+
+class ManagedPool():
+    # pool is opened with maxsize=upper, the adaptive cap below it is enforced here
+    def __init__(self, pool, lower, upper, maxsize=None, ping_after=30, grow_wait=0.005, shrink_wait=0.0005, adapt_interval=10):
+        self._pool = pool
+        self._lower = lower
+        self._upper = upper
+        self._cap = max(lower, min(upper, maxsize or upper))
+        self._inUse = 0
+        self._waiters = deque()
+        self._pingAfter = ping_after
+        self._growWait = grow_wait
+        self._shrinkWait = shrink_wait
+        self._adaptInterval = adapt_interval
+        self._lastUsed = weakref.WeakKeyDictionary()
+        self._window = []
+        self._adaptedAt = time.monotonic()
+        self.waitTime = Histogram()
+        self.counters = {'acquired': 0, 'pings': 0, 'dropped': 0, 'grown': 0, 'shrunk': 0}
+
+    @property
+    def maxsize(self):
+        return self._cap
+
+    @property
+    def busy(self):
+        return self._inUse / self._cap
+
+    def _resize(self, maxsize):
+        self._cap = maxsize
+        self._wake()
+
+    def _wake(self):
+        free = self._cap - self._inUse
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _reserve(self):
+        while self._inUse >= self._cap:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # pass the wakeup on to the next waiter
+                    self._wake()
+                raise
+        self._inUse += 1
+
+    def _unreserve(self):
+        self._inUse -= 1
+        self._wake()
+
+    def _adapt(self):
+        now = time.monotonic()
+        if now - self._adaptedAt < self._adaptInterval or not self._window:
+            return
+        avg = sum(self._window) / len(self._window)
+        self._window = []
+        self._adaptedAt = now
+        if avg > self._growWait and self.maxsize < self._upper:
+            self._resize(min(self._upper, self.maxsize + max(1, self.maxsize // 4)))
+            self.counters['grown'] += 1
+            logging.info("grow pool to {} (avg wait {:.4f}s)".format(self.maxsize, avg))
+        elif avg < self._shrinkWait and self.maxsize > self._lower and self._inUse < self.maxsize // 2:
+            self._resize(self.maxsize - 1)
+            self.counters['shrunk'] += 1
+            logging.info("shrink pool to {} (avg wait {:.4f}s)".format(self.maxsize, avg))
+
+    async def _checkout(self):
+        await self._reserve()
+        try:
+            return await self._connect()
+        except BaseException:
+            self._unreserve()
+            raise
+
+    async def _connect(self):
+        while True:
+            conn = await self._pool.acquire()
+            last = self._lastUsed.get(conn)
+            if last is None or time.monotonic() - last < self._pingAfter:
+                return conn
+            self.counters['pings'] += 1
+            try:
+                await conn.ping(reconnect=False)
+                return conn
+            except Exception as e:
+                logging.warning("drop stale connection: {}".format(e))
+                self.counters['dropped'] += 1
+                _prepared.pop(conn, None)
+                conn.close()
+                self._pool.release(conn)
+
+    def _checkin(self, conn):
+        self._lastUsed[conn] = time.monotonic()
+        if self._pool.size > self._cap and not conn.closed:
+            # shrunk below the open connections, retire this one instead of keeping it idle
+            _prepared.pop(conn, None)
+            conn.close()
+        self._pool.release(conn)
+        self._unreserve()
+
+    def acquire(self):
+        return _Checkout(self)
+
+    def stats(self):
+        return {
+            'size': self._pool.size,
+            'free': self._pool.freesize,
+            'in_use': self._inUse,
+            'waiting': len(self._waiters),
+            'minsize': self._pool.minsize,
+            'maxsize': self.maxsize,
+            'hard_maxsize': self._pool.maxsize,
+            'bounds': [self._lower, self._upper],
+            'wait': self.waitTime.snapshot(),
+            'counters': dict(self.counters)
+        }
+
+    def close(self):
+        self._pool.close()
+
+    async def wait_closed(self):
+        await self._pool.wait_closed()
+
+
+class _Checkout():
+    def __init__(self, pool):
+        self._managed = pool
+        self._conn = None
+
+    async def __aenter__(self):
+        pool = self._managed
+        start = time.monotonic()
+        self._conn = await pool._checkout()
+        wait = time.monotonic() - start
+        pool.waitTime.observe(wait)
+        pool._window.append(wait)
+        pool.counters['acquired'] += 1
+        pool._adapt()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._managed._checkin(self._conn)
+        self._conn = None
+
+
+def metrics():
+    return {
+        'pool': __pool.stats() if __pool is not None else None,
+        'replicas': [r.stats() for r in __replicas],
+        'query_time': _queryTime.snapshot(),
+        'statements': dict((sql, dict(c, time=round(c['time'], 6))) for sql, c in _statementCounters.items()),
+        'statement_cache': statementStats(),
+        'result_cache': cacheStats(),
+        'coalesce': flightStats()
+    }
+
+__pool = None
+__replicas = []
+_balance = 'round_robin'
+_sticky = 2
+_roundRobin = 0
+_lastWrite = dict()
+_primaryOnly = contextvars.ContextVar('primaryOnly', default=False)
+
+@contextlib.contextmanager
+def use_primary():
+    token = _primaryOnly.set(True)
+    try:
+        yield
+    finally:
+        _primaryOnly.reset(token)
+
+def wrote(table='*'):
+    _lastWrite[table] = time.monotonic()
+
+def read_pool(table=None):
+    global _roundRobin
+    if not __replicas or _primaryOnly.get():
+        return __pool
+    if time.monotonic() - _lastWrite.get(table or '*', 0) < _sticky:
+        return __pool
+    if _balance == 'least_busy':
+        return min(__replicas, key=lambda p: p.busy)
+    _roundRobin = (_roundRobin + 1) % len(__replicas)
+    return __replicas[_roundRobin]
+
+async def _create_pool(loop, kw):
+    maxsize = kw.get('maxsize', 10)
+    minsize = kw.get('minsize', 1)
+    pool = await aiomysql.create_pool(
         host=kw.get('host', 'localhost'),
         port=kw.get('port', 3306),
         user=kw.get('user', 'root'),
@@ -19,43 +372,112 @@ async def create_pool(loop, **kw):
         db=kw['database'],
         charset=kw.get('charset', 'utf8'),
         autocommit=kw.get('autocommit', True),
-        maxsize=kw.get('maxsize', 10),
-        minsize=kw.get('minsize', 1),
+        maxsize=kw.get('upper', maxsize * 2),
+        minsize=minsize,
+        pool_recycle=kw.get('recycle', 3600),
         loop=loop
     )
+    return ManagedPool(pool, kw.get('lower', max(minsize, 1)), kw.get('upper', maxsize * 2), maxsize,
+                       ping_after=kw.get('ping_after', 30), adapt_interval=kw.get('adapt_interval', 10))
+
+async def create_pool(loop, **kw):
+    logging.info("create datebase connection pool....")
+    global __pool, __replicas, _prepare, _coalesce, _balance, _sticky
+    _prepare = kw.get('prepare', False)
+    _coalesce = kw.get('coalesce', True)
+    _balance = kw.get('balance', 'round_robin')
+    _sticky = kw.get('sticky', 2)
+    __pool = await _create_pool(loop, kw)
+    __replicas = []
+    for replica in kw.get('replicas', None) or []:
+        logging.info("create replica connection pool {}:{}....".format(replica.get('host', kw.get('host')), replica.get('port', kw.get('port'))))
+        __replicas.append(await _create_pool(loop, dict(kw, **replica)))
 
 async def close_pool():
     global __pool
-    if __pool is not None:
-        __pool.close()
-        await __pool.wait_closed()
+    for counter in _counters:
+        await counter.flush()
+    for pool in [__pool] + __replicas:
+        if pool is not None:
+            pool.close()
+            await pool.wait_closed()
 
-async def select(sql, args, size=None):
+_coalesce = True
+_inflight = dict()
+_flightStats = {'calls': 0, 'deduplicated': 0}
+
+def flightStats():
+    return dict(_flightStats, inflight=len(_inflight))
+
+async def select(sql, args, size=None, table=None):
+    tx = current_transaction()
+    if tx is not None:
+        log(sql, args)
+        return await tx._root.select(sql, args, size)
+    pool = read_pool(table)
+    if not _coalesce:
+        return await _select(sql, args, size, pool)
+    # a write bumps the generation, so later reads never join a query that started before it
+    key = (str(sql), tuple(args or ()), size, pool is __pool, generation(table or '*'))
+    _flightStats['calls'] += 1
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_select(sql, args, size, pool))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _inflight.pop(key, None))
+    else:
+        _flightStats['deduplicated'] += 1
+    return await asyncio.shield(task)
+
+async def _select(sql, args, size, pool):
     log(sql, args)
-    global __pool
-    async with __pool.get() as conn:
+    async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cur:
-            await cur.execute(sql.replace('?', '%s'), args or ())
+            await _execute(cur, sql, args)
             if size:
                 rs = await cur.fetchmany(size)
             else:
                 rs = await cur.fetchall()
             await cur.close()
-        logging.info("rows return:{}".format(len(rs)))
-        conn.close()
-    #await close_pool()
+        sqlLogger.debug('rows return: %d', len(rs))
         return rs
 
+async def stream(sql, args, batch_size=100, table=None):
+    log(sql, args)
+    tx = current_transaction()
+    if tx is not None:
+        async for rs in tx._root.stream(sql, args, batch_size):
+            yield rs
+        return
+    async with read_pool(table).acquire() as conn:
+        async with conn.cursor(aiomysql.SSDictCursor) as cur:
+            await _execute(cur, sql, args)
+            while True:
+                rs = await cur.fetchmany(batch_size)
+                if not rs:
+                    break
+                yield rs
+
+_lastInsertId = contextvars.ContextVar('lastInsertId', default=None)
+
+def last_insert_id():
+    return _lastInsertId.get()
+
 async def execute(sql, args, autocommit=True):
     log(sql, args)
+    tx = current_transaction()
+    if tx is not None:
+        return await tx._root.execute(sql, args)
     global __pool
-    async with __pool.get() as conn:
+    wrote()
+    async with __pool.acquire() as conn:
         if not autocommit:
             await conn.begin()
         try:
             async with conn.cursor(aiomysql.DictCursor) as cur:
-                await cur.execute(sql.replace('?', '%s'), args)
+                await _execute(cur, sql, args)
                 affect = cur.rowcount
+                _lastInsertId.set(cur.lastrowid)
                 if not autocommit:
                     await conn.commit()
                     await cur.close()
@@ -63,11 +485,320 @@ async def execute(sql, args, autocommit=True):
             if not autocommit:
                 await conn.rollback()
             affect = 0
-        conn.close()
-    #await close_pool()
+        return affect
+
+async def execute_many(statements, autocommit=True):
+    tx = current_transaction()
+    if tx is not None:
+        affect = 0
+        for sql, args in statements:
+            log(sql, args)
+            rs = await tx._root.execute(sql, args)
+            affect = None if rs is None else affect + rs
+        return affect
+    global __pool
+    wrote()
+    affect = 0
+    async with __pool.acquire() as conn:
+        if not autocommit:
+            await conn.begin()
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                for sql, args in statements:
+                    log(sql, args)
+                    await _execute(cur, sql, args)
+                    affect += cur.rowcount
+            if not autocommit:
+                await conn.commit()
+        except Exception as e:
+            logging.warning("batch execute failed: {}".format(e))
+            if not autocommit:
+                await conn.rollback()
+                affect = 0
         return affect
 
 
+_transaction = contextvars.ContextVar('transaction', default=None)
+
+def current_transaction():
+    tx = _transaction.get()
+    return tx if tx is not None and tx.active else None
+
+def transaction(pipeline=False):
+    return Transaction(pipeline)
+
+def primary_pool():
+    return __pool
+
+class Transaction():
+    # pins one primary connection for the scope; nested scopes become savepoints
+    def __init__(self, pipeline=False):
+        self.pipeline = pipeline
+        self.active = False
+        self._root = self
+        self._conn = None
+        self._checkout = None
+        self._lock = None
+        self._queue = []
+        self._flushes = 0
+        self._savepoint = None
+        self._mark = None
+        self._tables = set()
+        self._events = []
+        self._token = None
+
+    async def __aenter__(self):
+        parent = current_transaction()
+        if parent is None:
+            self._checkout = primary_pool().acquire()
+            self._conn = await self._checkout.__aenter__()
+            self._lock = asyncio.Lock()
+            try:
+                await self._conn.begin()
+            except BaseException:
+                await self._checkout.__aexit__(None, None, None)
+                raise
+        else:
+            root = self._root = parent._root
+            self.pipeline = root.pipeline
+            self._savepoint = 'sp_{}'.format(id(self))
+            self._mark = (root._flushes, len(root._queue))
+            await root._control('SAVEPOINT ' + self._savepoint)
+        self.active = True
+        self._token = _transaction.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _transaction.reset(self._token)
+        self.active = False
+        if self._savepoint is not None:
+            await self._leaveSavepoint(exc_type is None)
+            return False
+        try:
+            if exc_type is None:
+                try:
+                    await self.flush()
+                    await self._conn.commit()
+                except BaseException:
+                    await self._rollback()
+                    raise
+            else:
+                await self._rollback()
+        finally:
+            await self._checkout.__aexit__(None, None, None)
+            self._conn = None
+        if exc_type is None:
+            for table in self._tables:
+                bump(table)
+            for model, event, payload in self._events:
+                await emit(model, event, payload)
+        return False
+
+    async def _leaveSavepoint(self, ok):
+        root = self._root
+        parent = _transaction.get()
+        if ok:
+            await root._control('RELEASE SAVEPOINT ' + self._savepoint)
+            parent._tables |= self._tables
+            parent._events.extend(self._events)
+            return
+        flushes, mark = self._mark
+        if root.pipeline and root._flushes == flushes:
+            # the SAVEPOINT itself has not been sent yet, dropping the queue tail is enough
+            del root._queue[mark:]
+        else:
+            root._queue = []
+            await root._control('ROLLBACK TO SAVEPOINT ' + self._savepoint)
+
+    async def _rollback(self):
+        self._queue = []
+        try:
+            await self._conn.rollback()
+        except Exception as e:
+            logging.warning("rollback failed, drop connection: {}".format(e))
+            self._conn.close()
+
+    async def _control(self, sql):
+        if self.pipeline:
+            self._queue.append((sql, sql, []))
+            return
+        async with self._lock:
+            async with self._conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(sql)
+
+    async def execute(self, sql, args):
+        stmt = sql if isinstance(sql, Statement) else statement(sql)
+        if self.pipeline:
+            self._queue.append((stmt.driver, stmt.sql, list(args or ())))
+            _lastInsertId.set(None)
+            return None
+        async with self._lock:
+            async with self._conn.cursor(aiomysql.DictCursor) as cur:
+                await _execute(cur, stmt, args)
+                _lastInsertId.set(cur.lastrowid)
+                return cur.rowcount
+
+    async def select(self, sql, args, size=None):
+        await self.flush()
+        async with self._lock:
+            async with self._conn.cursor(aiomysql.DictCursor) as cur:
+                await _execute(cur, sql, args)
+                if size:
+                    return await cur.fetchmany(size)
+                return await cur.fetchall()
+
+    async def stream(self, sql, args, batch_size=100):
+        # buffered: an unbuffered cursor would block every other statement on the pinned connection
+        rs = await self.select(sql, args)
+        for i in range(0, len(rs), batch_size):
+            yield rs[i:i + batch_size]
+
+    async def flush(self):
+        root = self._root
+        if not root._queue:
+            return 0
+        queue, root._queue = root._queue, []
+        root._flushes += 1
+        sql = ';'.join(driver for driver, text, args in queue)
+        args = [a for driver, text, params in queue for a in params]
+        log(sql, args)
+        affect = 0
+        start = time.monotonic()
+        async with root._lock:
+            async with root._conn.cursor(aiomysql.DictCursor) as cur:
+                try:
+                    await cur.execute(sql, args)
+                    affect = cur.rowcount
+                    while await cur.nextset():
+                        affect += max(cur.rowcount, 0)
+                except BaseException:
+                    _record('pipeline', time.monotonic() - start, True)
+                    raise
+        elapsed = time.monotonic() - start
+        _record('pipeline', elapsed)
+        profiler.record('sql', elapsed)
+        logging.info("pipelined {} statements in one round-trip".format(len(queue)))
+        return affect
+
+
+_generations = dict()
+
+def generation(table):
+    return _generations.get(table, 0)
+
+def bump(table):
+    tx = current_transaction()
+    if tx is not None:
+        # other readers keep their cache until the transaction commits
+        tx._tables.add(table)
+        return
+    _generations[table] = _generations.get(table, 0) + 1
+    _generations['*'] = _generations.get('*', 0) + 1
+    wrote(table)
+
+
+_tablesRead = contextvars.ContextVar('tablesRead', default=None)
+
+def track_reads():
+    tables = dict()
+    _tablesRead.set(tables)
+    return tables
+
+def read(table):
+    tables = _tablesRead.get()
+    if tables is not None and table not in tables:
+        tables[table] = generation(table)
+
+
+def sizeof(rs):
+    size = sys.getsizeof(rs)
+    for r in rs:
+        size += sys.getsizeof(r)
+        for v in r.values():
+            size += sys.getsizeof(v)
+    return size
+
+
+class CacheBackend():
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryCache(CacheBackend):
+    def __init__(self, maxsize=256, maxbytes=64 * 1024 * 1024):
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._data = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                self._pop(key)
+            self._stats['misses'] += 1
+            return None
+        self._data.move_to_end(key)
+        self._stats['hits'] += 1
+        return item[2]
+
+    def set(self, key, value, ttl):
+        if key in self._data:
+            self._pop(key)
+        size = sizeof(value)
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self._stats['bytes'] += size
+        while len(self._data) > self._maxsize or self._stats['bytes'] > self._maxbytes:
+            self._pop(next(iter(self._data)))
+            self._stats['evictions'] += 1
+
+    def _pop(self, key):
+        self._stats['bytes'] -= self._data.pop(key)[1]
+
+    def clear(self):
+        self._data.clear()
+        self._stats['bytes'] = 0
+
+    def stats(self):
+        return dict(self._stats, entries=len(self._data))
+
+
+_resultCache = MemoryCache()
+
+def set_cache(backend):
+    global _resultCache
+    _resultCache = backend
+
+def cacheStats():
+    return _resultCache.stats()
+
+async def cached_select(table, ttl, sql, args):
+    if current_transaction() is not None:
+        return await select(sql, args, table=table)
+    key = (str(sql), tuple(args), generation(table))
+    rs = _resultCache.get(key)
+    if rs is None:
+        rs = await select(sql, args, table=table)
+        _resultCache.set(key, rs, ttl)
+    return rs
+
+
+_advisor = None
+
+def set_advisor(advisor):
+    global _advisor
+    _advisor = advisor
+
+
 def create_args_string(num):
     argsList = []
     for x in range(num):
@@ -76,39 +807,52 @@ def create_args_string(num):
 
 
 class Field():
-    def __init__(self, name, column_type, primary_key, default):
+    def __init__(self, name, column_type, primary_key, default, deferred=False, index=False):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
+        self.deferred = deferred
+        # True for a secondary index, 'unique' for a unique one
+        self.index = index
 
     def __str__(self):
         return "{}, {}:{}".format(self.__class__.__name__, self.column_type, self.name)
 
 
 class StringField(Field):
-    def __init__(self, name=None, primary_key=False, default='', type='varchar(255)'):
-        super().__init__(name, type, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default='', type='varchar(255)', deferred=False, index=False):
+        super().__init__(name, type, primary_key, default, deferred, index)
 
 
 class BooleanField(Field):
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'Boolean', False, default)
+    def __init__(self, name=None, default=None, index=False):
+        super().__init__(name, 'Boolean', False, default, index=index)
 
 
 class IntegerField(Field):
-    def __init__(self, name=None, primary_key=False, default=0, type='int'):
-        super().__init__(name, type, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0, type='int', index=False):
+        super().__init__(name, type, primary_key, default, index=index)
 
 
 class FloatField(Field):
-    def __init__(self, name=None, primary_key=False, default=0.0, type='float'):
-        super().__init__(name, type, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0.0, type='float', index=False):
+        super().__init__(name, type, primary_key, default, index=index)
 
 
 class TextField(Field):
-    def __init__(self, name=None, default='', type='text'):
-        super().__init__(name, type, False, default)
+    def __init__(self, name=None, default='', type='text', deferred=False):
+        super().__init__(name, type, False, default, deferred)
+
+
+class ForeignKey():
+    def __init__(self, model, column, name=None):
+        self.model = model
+        self.column = column
+        self.name = name
+
+    def __str__(self):
+        return "{}, {} -> {}".format(self.__class__.__name__, self.column, self.model.__name__)
 
 
 class SQLError(Exception):
@@ -119,6 +863,205 @@ class SQLError(Exception):
         return repr(self.__error__)
 
 
+_listeners = dict()
+
+def listen(model, callback):
+    _listeners.setdefault(model.__table__, []).append(callback)
+
+def listening(model):
+    return model.__table__ in _listeners
+
+async def emit(model, event, payload):
+    tx = current_transaction()
+    if tx is not None:
+        tx._events.append((model, event, payload))
+        return
+    for callback in _listeners.get(model.__table__, []):
+        try:
+            await callback(event, model, payload)
+        except Exception:
+            logging.exception("listener of {} failed on {}".format(model.__table__, event))
+
+
+_counters = []
+_countersSuspended = False
+
+class Counter():
+    def __init__(self, model, fields, interval=5, threshold=500):
+        self._model = model
+        self._fields = list(fields)
+        self._interval = interval
+        self._threshold = threshold
+        self._pending = dict()
+        self._timer = None
+        self._lock = None
+        _counters.append(self)
+
+    def incr(self, pk, field, n=1):
+        if field not in self._fields:
+            raise ValueError("{} is not a counter of {}".format(field, self._model.__table__))
+        if _countersSuspended:
+            return
+        deltas = self._pending.setdefault(pk, dict())
+        deltas[field] = deltas.get(field, 0) + n
+        if len(self._pending) >= self._threshold:
+            self._schedule(0)
+        elif self._timer is None:
+            self._schedule(self._interval)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_event_loop()
+        # fresh context so a flush never joins a transaction that happened to schedule it
+        self._timer = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()), context=contextvars.Context())
+
+    def _sql(self, rows):
+        pk = self._model.__primary_key__
+        case = "CASE `{}` {} ELSE 0 END".format(pk, ' '.join(['WHEN ? THEN ?'] * rows))
+        sets = ','.join(map(lambda f: "`{0}` = `{0}` + {1}".format(f, case), self._fields))
+        return "update `{}` set {} where `{}` in ({})".format(self._model.__table__, sets, pk, create_args_string(rows))
+
+    def _restore(self, pending):
+        for pk, deltas in pending.items():
+            current = self._pending.setdefault(pk, dict())
+            for field, n in deltas.items():
+                current[field] = current.get(field, 0) + n
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            pending, self._pending = self._pending, dict()
+            if not pending:
+                return 0
+            affect = 0
+            try:
+                # execute() inside a transaction raises instead of returning 0, so failures are seen
+                async with transaction():
+                    items = list(pending.items())
+                    for i in range(0, len(items), self._threshold):
+                        chunk = items[i:i + self._threshold]
+                        args = []
+                        for field in self._fields:
+                            for pk, deltas in chunk:
+                                args.extend([pk, deltas.get(field, 0)])
+                        args.extend(pk for pk, deltas in chunk)
+                        sql = statement(('counter', self._model.__table__, tuple(self._fields), len(chunk)), lambda: self._sql(len(chunk)))
+                        affect += await execute(sql, args)
+            except Exception as e:
+                logging.warning("flush counters of {} failed, keep {} rows for retry: {}".format(self._model.__table__, len(pending), e))
+                self._restore(pending)
+                if self._timer is None:
+                    self._schedule(self._interval)
+                return 0
+        # counters are approximate, no cache generation bump so pages are not invalidated on every flush
+        logging.info("flushed {} counters of {}".format(len(pending), self._model.__table__))
+        return affect
+
+
+def suspend_counters(suspended=True):
+    global _countersSuspended
+    _countersSuspended = suspended
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    # the cursor comes from the client and ends up as sql args, accept only what encode_cursor makes
+    try:
+        rs = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError("invalid page cursor: {}".format(cursor))
+    if not isinstance(rs, list) or len(rs) != 2 or not all(v is None or (isinstance(v, (str, int, float)) and not isinstance(v, bool)) for v in rs):
+        raise ValueError("invalid page cursor: {}".format(cursor))
+    value, pk = rs
+    return value, pk
+
+
+class Row():
+    __slots__ = ('_extra',)
+    __fields__ = []
+
+    def __init__(self, **kw):
+        self._extra = None
+        for k, v in kw.items():
+            self[k] = v
+
+    @classmethod
+    def load(cls, r):
+        obj = cls.__new__(cls)
+        obj._extra = None
+        try:
+            for k, v in r.items():
+                setattr(obj, k, v)
+        except AttributeError:
+            for k, v in r.items():
+                obj[k] = v
+        return obj
+
+    def __getattr__(self, key):
+        if key != '_extra' and self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise AttributeError(r"'{}' object has no attribute '{}'".format(self.__class__.__name__, key))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Row, dict)):
+            return self.toDict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.toDict())
+
+    def get(self, key, default=None):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            return default
+
+    def keys(self):
+        keys = [f for f in self.__slots__ if hasattr(self, f)]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return keys
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def toDict(self):
+        return dict(self.items())
+
+
 class ModelMetaClass(type):
     def __new__(cls, name, base, attrs):
         if name == 'Model':
@@ -127,31 +1070,281 @@ class ModelMetaClass(type):
         logging.info("found Model : {}(table {})".format(name, tableName))
         mappings = dict()
         fields = []
+        relations = dict()
+        primaryKey = None
         for k, v in attrs.items():
             if isinstance(v, Field):
                 logging.info("found mapping: {} ==> {}".format(k, v))
                 mappings[k] = v
                 fields.append(k)
-        for k in mappings:
+                if v.primary_key:
+                    primaryKey = k
+            elif isinstance(v, ForeignKey):
+                logging.info("found relation: {} ==> {}".format(k, v))
+                v.name = k
+                relations[k] = v
+        for k in list(mappings) + list(relations):
             attrs.pop(k)
         escapeFiled = list(map(lambda f: '`{}`'.format(f), fields))
         attrs['__table__'] = tableName
         attrs['__fields__'] = fields
         attrs['__mappings__'] = mappings
+        attrs['__primary_key__'] = primaryKey
+        attrs['__relations__'] = relations
+        attrs['__deferred__'] = [f for f in fields if mappings[f].deferred]
+        indexes = [('idx_{}'.format(f), (f,), mappings[f].index == 'unique') for f in fields if mappings[f].index and not mappings[f].primary_key]
+        for columns in attrs.get('__indexes__', None) or []:
+            columns = (columns,) if isinstance(columns, str) else tuple(columns)
+            indexes.append(('idx_{}'.format('_'.join(columns)), columns, False))
+        attrs['__indexes__'] = indexes
         attrs['__insert__'] = "insert into `{}`({}) VALUES({}) ".format(tableName, ','.join(escapeFiled), create_args_string(len(fields)))
         attrs['__delete__'] = "delete from {}".format(tableName)
+        attrs['__row__'] = type(name + 'Row', (Row,), {
+            '__slots__': tuple(fields) + tuple(relations),
+            '__fields__': fields,
+            '__module__': attrs.get('__module__'),
+            '__qualname__': name + '.__row__'
+        })
         return type.__new__(cls, name, base, attrs)
 
 
+class Query():
+    def __init__(self, model):
+        self.model = model
+        self._where = []
+        self._args = []
+        self._select = []
+        self._limit = []
+        self._orderBy = []
+        self._cached = None
+        self._prefetch = []
+        self._undefer = None
+
+    def where(self, *params):
+        for param in params:
+            if len(param) > 2 and param[2].lower() in ('in', 'not in'):
+                values = list(param[1])
+                if not values:
+                    raise ValueError("empty list for {} {}".format(param[0], param[2]))
+                self._where.append("`{}` {} ({})".format(param[0], param[2], create_args_string(len(values))))
+                self._args.extend(values)
+            elif len(param) > 2:
+                self._where.append("`{}` {} ?".format(param[0],param[2]))
+                self._args.append(param[1])
+            elif len(param) == 2:
+                self._where.append("`{}` = ?".format(param[0]))
+                self._args.append(param[1])
+        return self
+
+    def choose(self, *params):
+        self._select.append(','.join(params))
+        return self
+
+    def undefer(self, *names):
+        self._undefer = tuple(self.model.__deferred__ if not names else names)
+        return self
+
+    def _columns(self):
+        if len(self._select) > 0:
+            return ','.join(self._select)
+        deferred = set(self.model.__deferred__) - set(self._undefer or ())
+        if not deferred:
+            return '*'
+        return ','.join('`{}`'.format(f) for f in self.model.__fields__ if f not in deferred)
+
+    def limit(self, params):
+        if isinstance(params, list):
+            if len(params) == 2:
+                self._limit.extend(int(p) for p in params)
+            else:
+                raise ValueError("too much parameters")
+        elif isinstance(params, int):
+            self._limit.append(params)
+        else:
+            raise ValueError("error type of parameters")
+        return self
+
+    def orderBy(self, params):
+        if isinstance(params, list):
+            self._orderBy.append("{} {}".format(params[0], params[1]))
+        return self
+
+    def cached(self, ttl=60):
+        self._cached = ttl
+        return self
+
+    def prefetch(self, *names):
+        for name in names:
+            if name not in self.model.__relations__:
+                raise ValueError("{} has no relation {}".format(self.model.__name__, name))
+            self._prefetch.append(name)
+        return self
+
+    async def _resolve(self, rows):
+        for name in self._prefetch:
+            relation = self.model.__relations__[name]
+            target = relation.model
+            ids = set()
+            for row in rows:
+                value = getattr(row, relation.column, None)
+                if value is not None:
+                    ids.add(value)
+            related = dict()
+            if ids:
+                query = target.find().where([target.__primary_key__, sorted(ids), 'in'])
+                if self._cached is not None:
+                    query.cached(self._cached)
+                for r in await query.all() or []:
+                    related[getattr(r, target.__primary_key__)] = r
+            for row in rows:
+                setattr(row, name, related.get(getattr(row, relation.column, None)))
+        return rows
+
+    def _whereSql(self, sql):
+        if len(self._where) > 0:
+            sql.append('where')
+            sql.append(' and '.join(self._where))
+        return ' '.join(sql)
+
+    def _selectSql(self):
+        sql = ["select {} from {}".format(self._columns(), self.model.__table__)]
+        if len(self._where) > 0:
+            sql.append('where')
+            sql.append(' and '.join(self._where))
+        if len(self._orderBy) > 0:
+            sql.append('order by')
+            sql.append(','.join(self._orderBy))
+        if len(self._limit) > 0:
+            sql.append('limit')
+            sql.append(create_args_string(len(self._limit)))
+        return ' '.join(sql)
+
+    def _selectStatement(self):
+        key = ('select', self.model.__table__, tuple(self._select), self._undefer, tuple(self._where), tuple(self._orderBy), len(self._limit))
+        return statement(key, self._selectSql)
+
+    def _observe(self, sql, args):
+        if _advisor is not None:
+            _advisor.record(self.model, self._where, self._orderBy, sql, args)
+
+    async def _query(self, sql, args):
+        read(self.model.__table__)
+        self._observe(sql, args)
+        if self._cached is None:
+            return await select(sql, args, table=self.model.__table__)
+        return await cached_select(self.model.__table__, self._cached, sql, args)
+
+    async def all(self):
+        rs = await self._query(self._selectStatement(), self._args + self._limit)
+        if len(rs) == 0:
+            return None
+        load = self.model.__row__.load
+        rows = [load(r) for r in rs]
+        if self._prefetch:
+            await self._resolve(rows)
+        return rows
+
+    async def paginate(self, after=None, order_by='id', page_size=20):
+        column, direction = order_by if isinstance(order_by, (list, tuple)) else (order_by, 'asc')
+        if self._limit:
+            raise ValueError("paginate sets its own limit, do not combine it with limit()")
+        direction = direction.lower()
+        if direction not in ('asc', 'desc'):
+            raise ValueError("error order direction: {}".format(direction))
+        pk = self.model.__primary_key__
+        op = '<' if direction == 'desc' else '>'
+        if after is not None:
+            value, last = decode_cursor(after)
+            if column == pk:
+                self._where.append("`{}` {} ?".format(pk, op))
+                self._args.append(last)
+            else:
+                self._where.append("(`{0}` {2} ? or (`{0}` = ? and `{1}` {2} ?))".format(column, pk, op))
+                self._args.extend([value, value, last])
+        self._orderBy.append("`{}` {}".format(column, direction))
+        if column != pk:
+            self._orderBy.append("`{}` {}".format(pk, direction))
+        if page_size is None:
+            return await self.all() or [], None
+        self._limit.append(page_size + 1)
+        rs = await self.all() or []
+        if len(rs) <= page_size:
+            return rs, None
+        rs = rs[:page_size]
+        return rs, encode_cursor(getattr(rs[-1], column), getattr(rs[-1], pk))
+
+    async def stream(self, batch_size=100, raw=False):
+        read(self.model.__table__)
+        load = self.model.__row__.load
+        sql = self._selectStatement()
+        self._observe(sql, self._args + self._limit)
+        async for rs in stream(sql, self._args + self._limit, batch_size, self.model.__table__):
+            if raw:
+                yield rs
+            elif self._prefetch:
+                yield await self._resolve([load(r) for r in rs])
+            else:
+                yield [load(r) for r in rs]
+
+    async def count(self):
+        table = self.model.__table__
+        key = ('count', table, tuple(self._where))
+        sql = statement(key, lambda: self._whereSql(["select count(*) as cnt from {}".format(table)]))
+        rs = await self._query(sql, self._args)
+        return rs[0]['cnt']
+
+    async def update(self, *params):
+        table = self.model.__table__
+        values = OrderedDict((param[0], param[1]) for param in params)
+        self.model.beforeUpdate(values)
+        updates = []
+        args = []
+        for name, value in values.items():
+            updates.append("`{}` = ?".format(name))
+            args.append(value)
+        args.extend(self._args)
+        key = ('update', table, tuple(updates), tuple(self._where))
+        sql = statement(key, lambda: self._whereSql(["update {} set {}".format(table, ','.join(updates))]))
+        pks = await self._pks()
+        self._observe(sql, args)
+        rs = await execute(sql, args)
+        bump(table)
+        if rs == 0:
+            logging.warning("fail to update record: affect rows {}".format(rs))
+            return False
+        if pks:
+            await emit(self.model, 'update', pks)
+        return True
+
+    async def remove(self):
+        key = ('delete', self.model.__table__, tuple(self._where))
+        pks = await self._pks()
+        sql = statement(key, lambda: self._whereSql([self.model.__delete__]))
+        self._observe(sql, self._args)
+        rs = await execute(sql, self._args)
+        bump(self.model.__table__)
+        if rs is not None and rs < 1:
+            logging.warning("delete failed")
+            return False
+        if pks:
+            await emit(self.model, 'remove', pks)
+        return True
+
+    async def _pks(self):
+        if not listening(self.model):
+            return None
+        pk = self.model.__primary_key__
+        query = Query(self.model).choose('`{}`'.format(pk))
+        query._where = list(self._where)
+        query._args = list(self._args)
+        with use_primary():
+            rs = await query.all() or []
+        return [getattr(r, pk) for r in rs]
+
+
 class Model(dict, metaclass=ModelMetaClass):
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
-        self.__where__ = []
-        self.__args__ = []
-        self.__select__ = []
-        self.__limit__ = []
-        self.__orderBy__ = []
-        self.__update__ = []
 
     def __getattr__(self, key):
         try:
@@ -175,112 +1368,75 @@ class Model(dict, metaclass=ModelMetaClass):
                 setattr(self, key, value)
         return value
 
+    def beforeSave(self):
+        pass
+
+    @classmethod
+    def beforeUpdate(cls, values):
+        pass
+
     @classmethod
     def find(cls):
         if cls.__name__ == 'Model':
             raise ValueError("can not use Model")
-        return cls()
-
-    def where(self, *params):
-        for param in params:
-            if len(param) > 2:
-                self.__where__.append("`{}` {} ?".format(param[0],param[2]))
-                self.__args__.append(param[1])
-            elif len(param) == 2:
-                self.__where__.append("`{}` = ?".format(param[0]))
-                self.__args__.append(param[1])
-        return self
-
-    async def all(self):
-        sql = []
-        if len(self.__select__) > 0:
-            sql.append("select {} from {}".format(','.join(self.__select__), self.__table__))
-        else:
-            sql.append("select * from {}".format(self.__table__))
-        args = []
-        if len(self.__where__) > 0:
-            sql.append('where')
-            sql.append(' and '.join(self.__where__))
-            args.extend(self.__args__)
-        if len(self.__orderBy__) > 0:
-            sql.append('order by')
-            sql.extend(self.__orderBy__)
-        if len(self.__limit__) > 0:
-            sql.append('limit')
-            sql.extend(self.__limit__)
-        rs = await select(' '.join(sql), args)
-        if len(rs) == 0:
-            return None
-        return [self.__class__(**r) for r in rs]
-
-    def choose(self, *params):
-        self.__select__.append(','.join(params))
-        return self
-
-    def limit(self, params):
-        if isinstance(params, list):
-            if len(params) == 2:
-                self.__limit__.append(','.join(params))
-            else:
-                raise ValueError("too much parameters")
-        elif isinstance(params, int):
-            self.__limit__.append(str(params))
-        else:
-            raise ValueError("error type of parameters")
-        return self
-
-    def orderBy(self, params):
-        if isinstance(params, list):
-            self.__orderBy__.append("{} {}".format(params[0], params[1]))
-        return self
-
-    async def count(self):
-        self.__sql__.append("select count(*) as cnt from {}".format(self.__table__))
-        args = []
-        if len(self.__where__) > 0:
-            self.__sql__.append('where')
-            self.__sql__.append(' and '.join(self.__where__))
-            args.extend(self.__args__['where'])
-        rs = await select(' '.join(self.__sql__), args)
-        return rs[0]['cnt']
+        return Query(cls)
 
     async def save(self):
+        self.beforeSave()
         args = list()
         args.extend(list(map(self.getValueOrDefault, self.__fields__)))
-        rs = await execute(self.__insert__, args)
-        if rs != 1:
+        rs = await execute(statement(self.__insert__), args)
+        bump(self.__table__)
+        if rs is not None and rs != 1:
             logging.warning('failed to insert record: affected rows: %s' % rs)
             return False
+        pk = self.__primary_key__
+        if pk is not None and not self.getValue(pk) and last_insert_id():
+            setattr(self, pk, last_insert_id())
+        await emit(self.__class__, 'save', [self])
         return True
 
-    async def update(self, *params):
-        args = []
-        for param in params:
-            self.__update__.append("`{}` = ?".format(param[0]))
-            args.append(param[1])
-        self.__sql__.append("update {} set {}".format(self.__table__, ','.join(self.__update__)))
-        if len(self.__where__) > 0:
-            self.__sql__.append('where')
-            self.__sql__.append(' and '.join(self.__where__))
-            args.extend(self.__args__['where'])
-        rs = await execute(' '.join(self.__sql__), args)
-        if rs == 0:
-            logging.warning("fail to update record: affect rows {}".format(rs))
-            return False
-        return True
+    @classmethod
+    def _insertManySql(cls, rows, upsert):
+        escapeFiled = ','.join(map(lambda f: '`{}`'.format(f), cls.__fields__))
+        values = ','.join(['({})'.format(create_args_string(len(cls.__fields__)))] * rows)
+        sql = "insert into `{}`({}) VALUES{}".format(cls.__table__, escapeFiled, values)
+        if upsert:
+            updates = [f for f in cls.__fields__ if not cls.__mappings__[f].primary_key]
+            sql += " on duplicate key update {}".format(','.join(map(lambda f: '`{0}` = VALUES(`{0}`)'.format(f), updates)))
+        return sql
 
-    async def remove(self):
-        self.__sql__.append(self.__delete__)
-        args = []
-        if len(self.__where__) > 0:
-            self.__sql__.append('where')
-            self.__sql__.append(' and '.join(self.__where__))
-            args.extend(self.__args__['where'])
-        rs = await execute(' '.join(self.__sql__), args)
-        if rs < 1:
-            logging.warning("delete failed")
-            return False
-        return True
+    @classmethod
+    async def save_many(cls, objs, chunk_size=1000, upsert=False, transaction=False):
+        statements = []
+        chunk = []
+        saved = [] if listening(cls) else None
+        for obj in objs:
+            if not isinstance(obj, cls):
+                obj = cls(**obj)
+            obj.beforeSave()
+            if saved is not None:
+                saved.append(obj)
+            chunk.extend(map(obj.getValueOrDefault, cls.__fields__))
+            if len(chunk) >= chunk_size * len(cls.__fields__):
+                statements.append(chunk)
+                chunk = []
+        if chunk:
+            statements.append(chunk)
+        if not statements:
+            return 0
+        batches = []
+        for args in statements:
+            rows = len(args) // len(cls.__fields__)
+            sql = statement(('insert', cls.__table__, rows, upsert), lambda: cls._insertManySql(rows, upsert))
+            batches.append((sql, args))
+        rs = await execute_many(batches, autocommit=not transaction)
+        bump(cls.__table__)
+        if rs == 0:
+            logging.warning('failed to insert records into {}'.format(cls.__table__))
+        elif saved:
+            await emit(cls, 'save', saved)
+        return rs
 
 
 # if __name__ == '__main__':
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import time, hashlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from aiohttp import web
+
+import orm
+from assets import acceptEncodings
+from compress import negotiate, variantTag
+
+class Page():
+    def __init__(self, body, content_type, charset, tables, ttl):
+        self.body = body
+        self.content_type = content_type
+        self.charset = charset
+        self.etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        # compressed bodies filled in by the compression middleware on first use
+        self.variants = dict()
+        self.modified = int(time.time())
+        self.last_modified = formatdate(self.modified, usegmt=True)
+        self.expires = time.monotonic() + ttl
+        self.generations = dict(tables)
+
+    def fresh(self):
+        if self.expires < time.monotonic():
+            return False
+        for table, gen in self.generations.items():
+            if orm.generation(table) != gen:
+                return False
+        return True
+
+    def headers(self, encoding='identity'):
+        return {
+            'ETag': variantTag(self.etag, encoding),
+            'Last-Modified': self.last_modified,
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding'
+        }
+
+    def notModified(self, request, etag=None):
+        inm = request.headers.get('If-None-Match')
+        if inm is not None:
+            tags = [t.strip() for t in inm.split(',')]
+            return '*' in tags or (etag or self.etag) in tags
+        ims = request.headers.get('If-Modified-Since')
+        if ims is not None:
+            date = parsedate_tz(ims)
+            return date is not None and self.modified <= mktime_tz(date)
+        return False
+
+    def response(self, request):
+        encoding = negotiate(acceptEncodings(request.headers.get('Accept-Encoding')), self.variants)
+        headers = self.headers(encoding)
+        if self.notModified(request, headers['ETag']):
+            return web.Response(status=304, headers=headers)
+        request['__page__'] = self
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+            return web.Response(body=self.variants[encoding], content_type=self.content_type, charset=self.charset, headers=headers)
+        return web.Response(body=self.body, content_type=self.content_type, charset=self.charset, headers=headers)
+
+
+class PageCache():
+    def __init__(self, ttl=60, maxsize=512):
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def key(self, request):
+        if request.method != 'GET':
+            return None
+        return request.path_qs
+
+    def get(self, key):
+        page = self._data.get(key)
+        if page is None or not page.fresh():
+            if page is not None:
+                del self._data[key]
+            self._stats['misses'] += 1
+            return None
+        self._data.move_to_end(key)
+        self._stats['hits'] += 1
+        return page
+
+    def set(self, key, body, content_type, charset, tables):
+        page = Page(body, content_type, charset, tables, self._ttl)
+        self._data[key] = page
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+        return page
+
+    def respond(self, page, request):
+        resp = page.response(request)
+        if resp.status == 304:
+            self._stats['not_modified'] += 1
+        return resp
+
+    def stats(self):
+        return dict(self._stats, entries=len(self._data))
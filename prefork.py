@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import os, signal, time, logging
+
+import profiler
+
+class Supervisor():
+    def __init__(self, target, workers, grace=30, backoff=0.5, max_backoff=30, stable=10):
+        self._target = target
+        self._workers = workers
+        self._grace = grace
+        self._backoff = backoff
+        self._maxBackoff = max_backoff
+        self._stable = stable
+        self._children = dict()
+        self._started = dict()
+        self._failures = dict()
+        self._respawn = dict()
+        self._retiring = dict()
+        self._stopping = False
+        self._restart = False
+
+    def spawn(self, workerId):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 0
+            try:
+                self._target(workerId)
+            except BaseException:
+                logging.exception("worker {} crashed".format(workerId))
+                code = 1
+            finally:
+                # os._exit skips atexit, flush queued log lines first
+                profiler.stop_logging()
+                os._exit(code)
+        logging.info("spawn worker {} pid {}".format(workerId, pid))
+        self._children[pid] = workerId
+        self._started[pid] = time.monotonic()
+        return pid
+
+    def _onStop(self, signum, frame):
+        self._stopping = True
+
+    def _onRestart(self, signum, frame):
+        self._restart = True
+
+    def _signal(self, pids, sig):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self._retiring:
+                del self._retiring[pid]
+                self._started.pop(pid, None)
+                continue
+            workerId = self._children.pop(pid, None)
+            started = self._started.pop(pid, None)
+            if workerId is not None and not self._stopping:
+                # crash loops (e.g. database down at startup) back off exponentially
+                if started is not None and time.monotonic() - started >= self._stable:
+                    self._failures[workerId] = 0
+                failures = self._failures.get(workerId, 0)
+                delay = min(self._maxBackoff, self._backoff * 2 ** failures)
+                self._failures[workerId] = failures + 1
+                self._respawn[workerId] = time.monotonic() + delay
+                logging.warning("worker {} pid {} exited with {}, respawn in {:.1f}s".format(workerId, pid, status, delay))
+
+    def _respawnDue(self):
+        now = time.monotonic()
+        for workerId, due in list(self._respawn.items()):
+            if due <= now:
+                del self._respawn[workerId]
+                self.spawn(workerId)
+
+    def _rotate(self):
+        logging.info("graceful restart of {} workers".format(len(self._children)))
+        old = self._children
+        self._children = dict()
+        self._respawn = dict()
+        deadline = time.monotonic() + self._grace
+        for pid in old:
+            self._retiring[pid] = deadline
+            self._started.pop(pid, None)
+        for workerId in range(self._workers):
+            self.spawn(workerId)
+        self._signal(old, signal.SIGTERM)
+
+    def _killOverdue(self):
+        now = time.monotonic()
+        overdue = [pid for pid, deadline in self._retiring.items() if deadline < now]
+        self._signal(overdue, signal.SIGKILL)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._onStop)
+        signal.signal(signal.SIGINT, self._onStop)
+        signal.signal(signal.SIGHUP, self._onRestart)
+        for workerId in range(self._workers):
+            self.spawn(workerId)
+        while not self._stopping:
+            if self._restart:
+                self._restart = False
+                self._rotate()
+            self._reap()
+            self._respawnDue()
+            self._killOverdue()
+            time.sleep(0.2)
+        self._respawn = dict()
+        logging.info("stopping {} workers".format(len(self._children) + len(self._retiring)))
+        deadline = time.monotonic() + self._grace
+        for pid in self._children:
+            self._retiring[pid] = deadline
+            self._started.pop(pid, None)
+        self._signal(list(self._children), signal.SIGTERM)
+        self._children = dict()
+        while self._retiring:
+            self._reap()
+            self._killOverdue()
+            time.sleep(0.2)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import logging, logging.handlers, queue, json, time, random, contextvars, atexit
+
+settings = {
+    'sample_rate': 0.01,
+    'slow_query': 0.1,
+    'explain': True,
+    'server_timing': False
+}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        rs = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        extra = getattr(record, 'data', None)
+        if extra is not None:
+            rs.update(extra)
+        if record.exc_info:
+            rs['exc'] = self.formatException(record.exc_info)
+        return json.dumps(rs, ensure_ascii=False, default=str)
+
+_listener = None
+
+def setup_logging(**kw):
+    global _listener
+    settings.update((k, kw[k]) for k in settings if k in kw)
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler()
+    if kw.get('json', False):
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    q = queue.SimpleQueue()
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(q))
+    root.setLevel(kw.get('level', 'INFO'))
+    _listener = logging.handlers.QueueListener(q, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+_current = contextvars.ContextVar('profile', default=None)
+_routes = dict()
+logger = logging.getLogger('profile')
+
+class Profile():
+    def __init__(self, route, sampled):
+        self.route = route
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.timings = {'handler': 0.0, 'sql': 0.0, 'render': 0.0}
+        self.queries = 0
+
+    def add(self, name, elapsed):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+        if name == 'sql':
+            self.queries += 1
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def headers(self):
+        total = self.total()
+        timing = ['{};dur={:.2f}'.format(name, value * 1000) for name, value in self.timings.items()]
+        timing.append('total;dur={:.2f}'.format(total * 1000))
+        return {
+            'X-Response-Time': '{:.2f}ms'.format(total * 1000),
+            'Server-Timing': ', '.join(timing)
+        }
+
+    def finish(self, status):
+        if not self.sampled:
+            return
+        total = self.total()
+        stats = _routes.setdefault(self.route, {'count': 0, 'total': 0.0, 'max': 0.0, 'sql': 0.0, 'render': 0.0, 'queries': 0})
+        stats['count'] += 1
+        stats['total'] += total
+        stats['max'] = max(stats['max'], total)
+        stats['sql'] += self.timings['sql']
+        stats['render'] += self.timings['render']
+        stats['queries'] += self.queries
+        logger.info("profile %s %s %.2fms sql=%.2fms/%d render=%.2fms", self.route, status, total * 1000,
+                    self.timings['sql'] * 1000, self.queries, self.timings['render'] * 1000, extra={'data': {
+            'route': self.route,
+            'status': status,
+            'total_ms': round(total * 1000, 3),
+            'queries': self.queries,
+            'timings_ms': dict((k, round(v * 1000, 3)) for k, v in self.timings.items())
+        }})
+
+
+def start(route):
+    sampled = random.random() < settings['sample_rate']
+    if not sampled and not settings['server_timing']:
+        _current.set(None)
+        return None
+    profile = Profile(route, sampled)
+    _current.set(profile)
+    return profile
+
+def record(name, elapsed):
+    profile = _current.get()
+    if profile is not None:
+        profile.add(name, elapsed)
+
+def stats():
+    return dict((route, dict(s, avg=s['total'] / s['count'])) for route, s in _routes.items())
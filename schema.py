@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import re, logging
+import orm
+
+TEXT_TYPES = ('text', 'tinytext', 'mediumtext', 'longtext', 'blob', 'mediumblob', 'longblob')
+INT_WIDTH = re.compile(r'^(tinyint|smallint|mediumint|int|integer|bigint)\(\d+\)')
+CONDITION = re.compile(r'`(\w+)`\s*(not in|in|<=|>=|!=|<>|=|<|>|like)', re.I)
+ORDER = re.compile(r'^\s*`?(\w+)`?')
+
+def literal(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+def normalize(column_type):
+    t = column_type.lower().strip()
+    if t in ('boolean', 'bool'):
+        return 'tinyint'
+    return INT_WIDTH.sub(r'\1', t)
+
+def column_sql(name, field):
+    sql = ['`{}`'.format(name), field.column_type]
+    if field.primary_key:
+        sql.append('NOT NULL')
+        if normalize(field.column_type).endswith('int'):
+            sql.append('AUTO_INCREMENT')
+    elif field.default is None:
+        sql.append('NULL')
+    else:
+        sql.append('NOT NULL')
+        if not callable(field.default) and normalize(field.column_type) not in TEXT_TYPES:
+            sql.append('DEFAULT ' + literal(field.default))
+    return ' '.join(sql)
+
+def index_sql(name, columns, unique):
+    return '{}INDEX `{}` ({})'.format('UNIQUE ' if unique else '', name, ','.join('`{}`'.format(c) for c in columns))
+
+def create_table_sql(model):
+    lines = [column_sql(f, model.__mappings__[f]) for f in model.__fields__]
+    if model.__primary_key__:
+        lines.append('PRIMARY KEY (`{}`)'.format(model.__primary_key__))
+    lines.extend(index_sql(name, columns, unique) for name, columns, unique in model.__indexes__)
+    return 'CREATE TABLE `{}` (\n  {}\n) ENGINE=InnoDB DEFAULT CHARSET=utf8'.format(model.__table__, ',\n  '.join(lines))
+
+def declared_indexes(model):
+    indexes = dict((name, list(columns)) for name, columns, unique in model.__indexes__)
+    if model.__primary_key__:
+        indexes['PRIMARY'] = [model.__primary_key__]
+    return indexes
+
+async def live_columns(model):
+    with orm.use_primary():
+        rs = await orm.select('select COLUMN_NAME as name, COLUMN_TYPE as type from information_schema.COLUMNS '
+                              'where TABLE_SCHEMA = DATABASE() and TABLE_NAME = ? order by ORDINAL_POSITION', [model.__table__])
+    return dict((r['name'], r['type']) for r in rs)
+
+async def live_indexes(model):
+    with orm.use_primary():
+        rs = await orm.select('select INDEX_NAME as name, COLUMN_NAME as col from information_schema.STATISTICS '
+                              'where TABLE_SCHEMA = DATABASE() and TABLE_NAME = ? order by INDEX_NAME, SEQ_IN_INDEX', [model.__table__])
+    indexes = dict()
+    for r in rs:
+        indexes.setdefault(r['name'], []).append(r['col'])
+    return indexes
+
+async def diff(model, drop=False):
+    table = model.__table__
+    columns = await live_columns(model)
+    if not columns:
+        return [create_table_sql(model)]
+    statements = []
+    for f in model.__fields__:
+        field = model.__mappings__[f]
+        if f not in columns:
+            statements.append('ALTER TABLE `{}` ADD COLUMN {}'.format(table, column_sql(f, field)))
+        elif normalize(columns[f]) != normalize(field.column_type):
+            statements.append('ALTER TABLE `{}` MODIFY COLUMN {}'.format(table, column_sql(f, field)))
+    indexes = await live_indexes(model)
+    existing = [tuple(c) for c in indexes.values()]
+    for name, cols, unique in model.__indexes__:
+        if tuple(cols) not in existing:
+            statements.append('ALTER TABLE `{}` ADD {}'.format(table, index_sql(name, cols, unique)))
+    if drop:
+        for name in columns:
+            if name not in model.__mappings__:
+                statements.append('ALTER TABLE `{}` DROP COLUMN `{}`'.format(table, name))
+        declared = [tuple(cols) for name, cols, unique in model.__indexes__]
+        for name, cols in indexes.items():
+            if name != 'PRIMARY' and tuple(cols) not in declared:
+                statements.append('ALTER TABLE `{}` DROP INDEX `{}`'.format(table, name))
+    return statements
+
+async def migrate(models, apply=False, drop=False):
+    statements = []
+    for model in models:
+        statements.extend(await diff(model, drop))
+    if apply:
+        for sql in statements:
+            logging.info("migrate: {}".format(sql))
+            await run_ddl(sql)
+    return statements
+
+async def run_ddl(sql):
+    # not orm.execute, which swallows errors and would report a failed ALTER as applied
+    async with orm.primary_pool().acquire() as conn:
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(sql)
+        except Exception as e:
+            raise orm.SQLError('{}: {}'.format(sql, e))
+
+
+class Shape():
+    def __init__(self, model, where, orderBy):
+        self.model = model
+        self.eq = []
+        self.range = []
+        for fragment in where:
+            for column, op in CONDITION.findall(fragment):
+                target = self.eq if op.lower() in ('=', 'in') else self.range
+                if column not in self.eq and column not in self.range:
+                    target.append(column)
+        self.order = [m.group(1) for m in map(ORDER.match, orderBy) if m]
+        self.calls = 0
+        self.sample = None
+
+    def need(self):
+        # equality columns in any order, then the first range or order column
+        rest = self.range[:1] or [c for c in self.order[:1] if c not in self.eq]
+        return self.eq + rest
+
+    def covered(self, columns):
+        eq = set(self.eq)
+        n = 0
+        for column in columns:
+            if column not in eq:
+                break
+            eq.discard(column)
+            n += 1
+        if eq:
+            return n
+        rest = self.need()[len(self.eq):]
+        if rest and n < len(columns) and columns[n] == rest[0]:
+            n += 1
+        return n
+
+
+class Advisor():
+    # records where/order by shapes issued by Query and reports the ones without a supporting index
+    def __init__(self, maxsize=500):
+        self._maxsize = maxsize
+        self._shapes = dict()
+
+    def record(self, model, where, orderBy, sql, args):
+        key = (model.__table__, tuple(where), tuple(orderBy))
+        shape = self._shapes.get(key)
+        if shape is None:
+            if len(self._shapes) >= self._maxsize:
+                return
+            shape = self._shapes[key] = Shape(model, where, orderBy)
+        shape.calls += 1
+        shape.sample = (sql, list(args or ()))
+
+    async def _indexes(self, model, live):
+        indexes = declared_indexes(model)
+        if live:
+            try:
+                indexes = await live_indexes(model) or indexes
+            except Exception as e:
+                logging.warning("read indexes of {} failed: {}".format(model.__table__, e))
+        pk = model.__primary_key__
+        # InnoDB secondary indexes end with the primary key
+        return dict((name, cols if name == 'PRIMARY' or pk is None or pk in cols else cols + [pk]) for name, cols in indexes.items())
+
+    async def report(self, live=True, explain=True):
+        advice = []
+        cache = dict()
+        for shape in sorted(self._shapes.values(), key=lambda s: -s.calls):
+            need = shape.need()
+            if not need:
+                continue
+            table = shape.model.__table__
+            if table not in cache:
+                cache[table] = await self._indexes(shape.model, live)
+            best, used = 0, None
+            for name, cols in cache[table].items():
+                n = shape.covered(cols)
+                if n > best:
+                    best, used = n, name
+            if best == len(need):
+                continue
+            item = {
+                'table': table,
+                'where': shape.eq + shape.range,
+                'order': shape.order,
+                'calls': shape.calls,
+                'index': used,
+                'status': 'partial' if best else 'missing',
+                'suggest': 'ALTER TABLE `{}` ADD {}'.format(table, index_sql('idx_' + '_'.join(need), need, False)),
+                'sql': str(shape.sample[0])
+            }
+            if explain:
+                rs = await orm.explain(shape.sample[0], shape.sample[1])
+                if isinstance(rs, list):
+                    item['explain'] = [dict((k, r.get(k)) for k in ('table', 'type', 'key', 'rows', 'Extra')) for r in rs]
+                else:
+                    item['explain'] = rs
+            advice.append(item)
+        return advice
+
+    def clear(self):
+        self._shapes = dict()
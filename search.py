@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+__author__ = 'Ernie Peng'
+
+import os, re, math, mmap, json, struct, logging, time, uuid, fcntl, asyncio, contextlib
+from collections import Counter as TermCounter
+
+import orm
+
+MAGIC = b'WSIX'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+POSTING = struct.Struct('<If')
+
+_tag = re.compile(r'<[^>]+>')
+_word = re.compile(r'[0-9a-z]+|[\u3400-\u9fff\uf900-\ufaff]+')
+_cjk = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
+def tokenize(text):
+    tokens = []
+    for word in _word.findall(_tag.sub(' ', text or '').lower()):
+        if not _cjk.match(word):
+            tokens.append(word)
+            continue
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+class SearchIndex():
+    # an mmapped snapshot plus a change log shared by every worker process;
+    # each worker replays the log, compaction folds it into a new snapshot
+    def __init__(self, model, path, fields=None, persist_every=200, k1=1.2, b=0.75):
+        self.model = model
+        self.path = path
+        self.fields = fields or {'title': 3.0, 'tag': 2.0, 'content': 1.0}
+        self._persistEvery = persist_every
+        self._k1 = k1
+        self._b = b
+        self._file = None
+        self._map = None
+        self._terms = dict()
+        self._lengths = dict()
+        self._added = dict()
+        self._removed = set()
+        self._changes = 0
+        self._epoch = None
+        self._journal = (None, 0, None)
+        self._flushing = None
+        self._pending = []
+        self._writing = None
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.lock', 'a') as f:
+            try:
+                fcntl.flock(f, mode)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _weights(self, row):
+        weights = TermCounter()
+        for field, weight in self.fields.items():
+            for token in tokenize(getattr(row, field, None) if not isinstance(row, dict) else row.get(field)):
+                weights[token] += weight
+        return weights
+
+    def _apply(self, entry):
+        pk = entry['pk']
+        if pk in self._lengths:
+            del self._lengths[pk]
+            self._removed.add(pk)
+            for postings in self._added.values():
+                postings.pop(pk, None)
+        weights = entry.get('w')
+        if weights is not None:
+            self._lengths[pk] = sum(weights.values())
+            for term, weight in weights.items():
+                self._added.setdefault(term, dict())[pk] = weight
+
+    def add(self, row):
+        pk = getattr(row, self.model.__primary_key__, None) if not isinstance(row, dict) else row.get(self.model.__primary_key__)
+        if not pk:
+            return
+        self._log({'pk': pk, 'w': self._weights(row)})
+
+    def discard(self, pk):
+        self._log({'pk': pk})
+
+    def _log(self, entry):
+        self._pending.append((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8'))
+        if self._writing is None:
+            self._writing = asyncio.ensure_future(self._write())
+        self._changed()
+
+    async def _write(self):
+        # changes queued meanwhile share one locked append, done off the event loop
+        try:
+            while self._pending:
+                lines, self._pending = self._pending, []
+                try:
+                    await asyncio.get_event_loop().run_in_executor(None, self._append, b''.join(lines))
+                except Exception:
+                    self._pending[:0] = lines
+                    logging.exception("append to search journal {}.log failed".format(self.path))
+                    break
+                # replay on the loop thread, our own lines come back in journal order
+                self._sync(wait=False)
+        finally:
+            self._writing = None
+
+    def _append(self, data):
+        # touches files only, index state stays with the event loop thread
+        with self._locked(fcntl.LOCK_SH):
+            if not os.path.exists(self.path + '.log'):
+                self._writeJournal(self.path + '.log', self._epoch, b'')
+            with open(self.path + '.log', 'ab') as f:
+                f.write(data)
+
+    def _changed(self):
+        self._changes += 1
+        if self._persistEvery and self._changes >= self._persistEvery and self._flushing is None:
+            self._flushing = asyncio.ensure_future(self.flush())
+
+    def _sync(self, wait=True):
+        with self._locked(fcntl.LOCK_SH if wait else fcntl.LOCK_SH | fcntl.LOCK_NB) as locked:
+            if locked:
+                self._syncLocked()
+
+    def _syncLocked(self):
+        try:
+            f = open(self.path + '.log', 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            inode, offset, epoch = self._journal
+            if st.st_ino == inode and st.st_size == offset:
+                return
+            if st.st_ino != inode:
+                header = f.readline()
+                epoch = json.loads(header.decode('utf-8'))['epoch']
+                if epoch != self._epoch:
+                    # another worker compacted, start over from its snapshot
+                    self._load()
+                offset = len(header)
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(json.loads(line.decode('utf-8')))
+        self._journal = (st.st_ino, offset + end, epoch)
+
+    def _postings(self, term):
+        rs = dict()
+        location = self._terms.get(term)
+        if location is not None:
+            offset, count = location
+            for pk, weight in POSTING.iter_unpack(self._map[offset:offset + count * POSTING.size]):
+                if pk not in self._removed:
+                    rs[pk] = weight
+        rs.update(self._added.get(term, {}))
+        return rs
+
+    def search(self, q, page=1, size=10):
+        start = time.perf_counter()
+        # pick up other workers' changes, skipped while a compaction swaps files
+        self._sync(wait=False)
+        n = len(self._lengths)
+        avgdl = (sum(self._lengths.values()) / n) if n else 0
+        scores = dict()
+        for term in set(tokenize(q)):
+            postings = self._postings(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for pk, tf in postings.items():
+                norm = self._k1 * (1 - self._b + self._b * self._lengths.get(pk, avgdl) / avgdl) if avgdl else self._k1
+                scores[pk] = scores.get(pk, 0.0) + idf * tf * (self._k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        offset = (page - 1) * size
+        logging.debug("search {!r}: {} hits in {:.2f}ms".format(q, len(ranked), (time.perf_counter() - start) * 1000))
+        return len(ranked), ranked[offset:offset + size]
+
+    def load(self):
+        with self._locked(fcntl.LOCK_SH):
+            if not self._load():
+                return False
+            self._syncLocked()
+        logging.info("loaded search index {}: {} docs, {} terms".format(self.path, len(self._lengths), len(self._terms)))
+        return True
+
+    def _reset(self):
+        self.close()
+        self._terms = dict()
+        self._lengths = dict()
+        self._added = dict()
+        self._removed = set()
+        self._epoch = None
+        self._journal = (None, 0, None)
+
+    def _load(self):
+        self._reset()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return False
+        f = open(self.path, 'rb')
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metaOffset, metaLength = HEADER.unpack(m[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            m.close()
+            f.close()
+            logging.warning("ignore search index {}: bad header".format(self.path))
+            return False
+        meta = json.loads(m[metaOffset:metaOffset + metaLength].decode('utf-8'))
+        self._file, self._map = f, m
+        self._terms = meta['terms']
+        self._lengths = dict((int(pk), length) for pk, length in meta['lengths'].items())
+        self._epoch = meta.get('epoch')
+        return True
+
+    def _writeSnapshot(self, epoch):
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        terms = set(self._terms) | set(self._added)
+        locations = dict()
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            for term in sorted(terms):
+                postings = self._postings(term)
+                if not postings:
+                    continue
+                locations[term] = [f.tell(), len(postings)]
+                f.write(b''.join(POSTING.pack(pk, weight) for pk, weight in sorted(postings.items())))
+            meta = json.dumps({'terms': locations, 'lengths': self._lengths, 'epoch': epoch}, ensure_ascii=False).encode('utf-8')
+            metaOffset = f.tell()
+            f.write(meta)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, metaOffset, len(meta)))
+        return tmp
+
+    def _writeJournal(self, path, epoch, tail):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write((json.dumps({'epoch': epoch}) + '\n').encode('utf-8'))
+            f.write(tail)
+        os.replace(tmp, path)
+
+    def compact(self):
+        # blocking, run it off the event loop; readers only wait for the final swap
+        epoch = uuid.uuid4().hex
+        with self._locked(fcntl.LOCK_SH):
+            self._load()
+            self._syncLocked()
+            inode, offset, journalEpoch = self._journal
+            tmp = self._writeSnapshot(epoch)
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                f = open(self.path + '.log', 'rb')
+            except FileNotFoundError:
+                f = None
+            if f is not None:
+                with f:
+                    if os.fstat(f.fileno()).st_ino != inode:
+                        # someone else compacted in between, theirs wins
+                        os.remove(tmp)
+                        return False
+                    f.seek(offset)
+                    tail = f.read()
+            elif inode is not None:
+                os.remove(tmp)
+                return False
+            else:
+                tail = b''
+            os.replace(tmp, self.path)
+            self._writeJournal(self.path + '.log', epoch, tail)
+        return True
+
+    def persist(self):
+        # runs in an executor, so it compacts through a private instance and leaves ours alone
+        index = SearchIndex(self.model, self.path, self.fields, 0)
+        try:
+            index.compact()
+        finally:
+            index.close()
+
+    async def flush(self):
+        self._changes = 0
+        try:
+            if self._writing is not None:
+                await self._writing
+            await asyncio.get_event_loop().run_in_executor(None, self.persist)
+            self._sync()
+        finally:
+            self._flushing = None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    async def rebuild(self, batch_size=500):
+        start = time.perf_counter()
+        self._reset()
+        columns = [self.model.__primary_key__] + list(self.fields)
+        async for rows in self.model.find().choose(*('`{}`'.format(c) for c in columns)).stream(batch_size, raw=True):
+            for row in rows:
+                self._apply({'pk': row[self.model.__primary_key__], 'w': self._weights(row)})
+        epoch = uuid.uuid4().hex
+        tmp = self._writeSnapshot(epoch)
+        with self._locked(fcntl.LOCK_EX):
+            os.replace(tmp, self.path)
+            self._writeJournal(self.path + '.log', epoch, b'')
+        self.load()
+        logging.info("rebuilt search index of {} docs in {:.1f}ms".format(len(self._lengths), (time.perf_counter() - start) * 1000))
+
+    async def _refresh(self, pks):
+        pk = self.model.__primary_key__
+        columns = [pk] + list(self.fields)
+        rows = await self.model.find().choose(*('`{}`'.format(c) for c in columns)).where([pk, pks, 'in']).all() or []
+        found = set()
+        for row in rows:
+            found.add(getattr(row, pk))
+            self.add(row)
+        for missing in set(pks) - found:
+            self.discard(missing)
+
+    async def _catchUp(self):
+        # bulk inserts and pipelined saves carry no ids; auto-increment puts new rows above every indexed one
+        pk = self.model.__primary_key__
+        columns = [pk] + list(self.fields)
+        query = self.model.find().choose(*('`{}`'.format(c) for c in columns))
+        if self._lengths:
+            query.where([pk, max(self._lengths), '>'])
+        async for rows in query.stream(raw=True):
+            for row in rows:
+                self.add(row)
+
+    async def on_change(self, event, model, payload):
+        if event == 'save':
+            missing = False
+            for obj in payload:
+                if obj.getValue(model.__primary_key__):
+                    self.add(obj)
+                else:
+                    missing = True
+            if missing:
+                with orm.use_primary():
+                    await self._catchUp()
+        elif event == 'update':
+            with orm.use_primary():
+                await self._refresh(payload)
+        elif event == 'remove':
+            for pk in payload:
+                self.discard(pk)
+
+
+async def init_search(model, **kw):
+    path = kw.get('path', None) or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build', 'search.idx')
+    index = SearchIndex(model, path, persist_every=kw.get('persist_every', 200))
+    if not index.load():
+        await index.rebuild()
+    orm.listen(model, index.on_change)
+    return index
@@ -1,7 +1,128 @@
-from bs4 import BeautifulSoup
-import re
-def cut_html(html, count):
-    text = re.findall("<.*?>.*?</.*?>", html)
+import re, functools
+from html import escape
+from html.parser import HTMLParser
+
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'])
+SKIP_TAGS = frozenset(['script', 'style', 'template', 'iframe', 'object', 'noscript', 'svg', 'math', 'textarea', 'select', 'title'])
+# excerpts are rendered unescaped, only this markup survives
+ALLOWED_TAGS = frozenset(['p', 'br', 'b', 'strong', 'i', 'em', 'u', 's', 'del', 'ins', 'sub', 'sup', 'code', 'pre', 'blockquote',
+                          'ul', 'ol', 'li', 'a', 'span', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'img'])
+ALLOWED_ATTRS = {'a': ('href', 'title'), 'img': ('src', 'alt', 'title')}
+URL_ATTRS = frozenset(['href', 'src'])
+SAFE_SCHEMES = frozenset(['http', 'https', 'mailto'])
+_scheme = re.compile(r'^([a-z][a-z0-9+.\-]*):', re.I)
+_control = re.compile(r'[\x00-\x20\x7f]+')
+_space = re.compile(r'\s+')
+
+
+class Truncated(Exception):
+    pass
+
+
+class HTMLTruncator(HTMLParser):
+    def __init__(self, count, suffix='...', text_only=False):
+        super().__init__(convert_charrefs=True)
+        self.count = count
+        self.suffix = suffix
+        self.text_only = text_only
+        self.out = []
+        self.stack = []
+        self.visible = 0
+        self.skip = 0
+        self.space = True
+        self.truncated = False
+
+    def _attrs(self, tag, attrs):
+        allowed = ALLOWED_ATTRS.get(tag, ())
+        out = []
+        for k, v in attrs:
+            if k not in allowed or v is None:
+                continue
+            if k in URL_ATTRS:
+                m = _scheme.match(_control.sub('', v))
+                if m is not None and m.group(1).lower() not in SAFE_SCHEMES:
+                    continue
+            out.append(' {}="{}"'.format(k, escape(v, quote=True)))
+        return ''.join(out)
+
+    def _emit(self, tag):
+        return not self.skip and not self.text_only and tag in ALLOWED_TAGS
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip += 1
+            return
+        if not self._emit(tag):
+            return
+        self.out.append('<{}{}>'.format(tag, self._attrs(tag, attrs)))
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in SKIP_TAGS or not self._emit(tag):
+            return
+        self.out.append('<{}{} />'.format(tag, self._attrs(tag, attrs)))
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip = max(self.skip - 1, 0)
+            return
+        if self.skip or tag not in self.stack:
+            return
+        while self.stack:
+            open = self.stack.pop()
+            self.out.append('</{}>'.format(open))
+            if open == tag:
+                break
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        text = _space.sub(' ', data)
+        if self.space:
+            text = text.lstrip(' ')
+        if not text:
+            return
+        left = self.count - self.visible
+        if len(text) > left:
+            self.out.append(escape(text[:left].rstrip(' '), quote=False) + self.suffix)
+            self.visible = self.count
+            self.truncated = True
+            raise Truncated()
+        self.out.append(escape(text, quote=False))
+        self.visible += len(text)
+        self.space = text.endswith(' ')
+
+    def result(self):
+        return ''.join(self.out) + ''.join('</{}>'.format(tag) for tag in reversed(self.stack))
+
+
+def cut_html(html, count, suffix='...', chunk_size=4096, text_only=False):
+    if count is None or count < 0:
+        count = float('inf')
+    parser = HTMLTruncator(count, suffix, text_only)
+    try:
+        for i in range(0, len(html or ''), chunk_size):
+            parser.feed(html[i:i + chunk_size])
+        parser.close()
+    except Truncated:
+        pass
+    return parser.result()
+
+def fit_html(html, count, limit, step=20):
+    # shrink the excerpt until it fits the column, dropping markup as the last resort
+    for text_only in (False, True):
+        n = count
+        while n >= 0:
+            rs = cut_html(html, n, text_only=text_only)
+            if len(rs) <= limit:
+                return rs
+            n -= step
+    return ''
+
+@functools.lru_cache(maxsize=2048)
+def sanitize_html(html):
+    return cut_html(html, None)
 
 
 
@@ -16,4 +137,4 @@ and they lived at the bottom of a well.</p>
 <p class="story">...</p>
 """
 if __name__ == '__main__':
-    cut_html(html_doc, -1)
\ No newline at end of file
+    print(cut_html(html_doc, 80))
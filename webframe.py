@@ -3,8 +3,8 @@ __author__ = 'Ernie Peng'
 
 import asyncio, os, inspect, functools
 import logging;logging.basicConfig(level=logging.INFO)
-from urllib import parse
 from aiohttp import web
+from assets import Assets
 
 def get(path):
     def decorator(func):
@@ -18,7 +18,7 @@ def get(path):
 
 def post(path):
     def decorator(func):
-        @functools.wraps()
+        @functools.wraps(func)
         def wraps(*args, **kw):
             return func(*args, **kw)
         wraps.__method__ = 'POST'
@@ -35,60 +35,142 @@ def hasRequestArgs(func):
             raise ValueError("request must be last parameters in function: {}{}".format(func.__name__, str(inspect.signature(func))))
     return rs
 
+def _toBool(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+_converters = {
+    int: int,
+    float: float,
+    bool: _toBool,
+    str: str
+}
+
+class Param():
+    def __init__(self, name, required, converter, many):
+        self.name = name
+        self.required = required
+        self.converter = converter
+        self.many = many
+
+def bindParams(func):
+    params = []
+    varKw = False
+    for name, value in inspect.signature(func).parameters.items():
+        if name == 'request' or value.kind == inspect.Parameter.VAR_POSITIONAL:
+            continue
+        if value.kind == inspect.Parameter.VAR_KEYWORD:
+            varKw = True
+            continue
+        annotation = value.annotation
+        many = annotation is list or getattr(annotation, '__origin__', None) is list
+        if many:
+            itemType = getattr(annotation, '__args__', (str,))[0]
+            converter = _converters.get(itemType)
+        else:
+            converter = _converters.get(annotation)
+        params.append(Param(name, value.default is inspect.Parameter.empty, converter, many))
+    return params, varKw
+
 class RequestHandler():
     def __init__(self, func):
         self._func = func
-        self._requiredArgs = inspect.signature(func).parameters.keys()
+        self._params, self._varKw = bindParams(func)
         self._hasRequestArgs = hasRequestArgs(func)
+        self._names = frozenset(p.name for p in self._params)
+        self._needsInput = len(self._params) > 0 or self._varKw
+
+    async def _body(self, request):
+        if not request.content_type:
+            raise web.HTTPBadRequest(text='Missing Content-Type.')
+        ct = request.content_type.lower()
+        if ct.startswith("application/json"):
+            params = await request.json()
+            if not isinstance(params, dict):
+                raise web.HTTPBadRequest(text='JSON body must be object.')
+            return params
+        elif ct.startswith("application/x-www-form-urlencoded") or ct.startswith('multipart/form-data'):
+            return await request.post()
+        raise web.HTTPBadRequest(text='Unsupported Content-Type: %s' % request.content_type)
 
     async def __call__(self, request):
-        kw = {}
-        if len(self._requiredArgs) > 0:
+        args = {}
+        if self._needsInput:
+            match = request.match_info
             if request.method == 'POST':
-                if not request.content_type:
-                    return web.HTTPBadRequest('Missing Content-Type.')
-                ct = request.content_type.lower()
-                if ct.startswith("application/json"):
-                    params = await request.json()
-                    if not isinstance(params, dict):
-                        return web.HTTPBadRequest('JSON body must be object.')
-                    kw = params
-                elif ct.startswith("application/x-www-form-urlencoded") or ct.startswith('multipart/form-data'):
-                    params = await request.post()
-                    kw = dict(**params)
+                try:
+                    source = await self._body(request)
+                except web.HTTPBadRequest as e:
+                    return e
+            else:
+                source = request.query
+            for p in self._params:
+                if p.name in match:
+                    value = [match[p.name]] if p.many else match[p.name]
+                elif p.name in source:
+                    if p.many:
+                        value = source.getall(p.name) if hasattr(source, 'getall') else source[p.name]
+                        if not isinstance(value, list):
+                            value = [value]
+                    else:
+                        value = source[p.name]
+                elif p.required:
+                    return web.HTTPBadRequest(text='Missing argument: %s' % p.name)
                 else:
-                    return web.HTTPBadRequest('Unsupported Content-Type: %s' % request.content_type)
-            if request.method == 'GET':
-                qs = request.query_string
-                if qs:
-                    for k, v in parse.parse_qs(qs, True).items():
-                        kw[k] = v
-        for name, value in request.match_info.items():
-            if name in self._requiredArgs:
-                kw[name] = value
+                    continue
+                if p.converter is not None:
+                    try:
+                        value = [p.converter(v) for v in value] if p.many else p.converter(value)
+                    except (TypeError, ValueError):
+                        return web.HTTPBadRequest(text='Invalid argument: %s' % p.name)
+                args[p.name] = value
+            if self._varKw:
+                for name in source:
+                    if name not in self._names and name not in args:
+                        args[name] = source[name]
+                for name, value in match.items():
+                    if name not in self._names:
+                        args[name] = value
         if self._hasRequestArgs:
-            kw['request'] = request
-        for key in self._requiredArgs:
-            if not key in kw:
-                return web.HTTPBadRequest('Missing argument: %s' % key)
-        args = {}
-        for key in kw:
-            if key in self._requiredArgs:
-                args[key] = kw[key]
+            args['request'] = request
         return await self._func(**args)
 
-def add_static(app):
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'static')
-    app.router.add_static('/static/', path)
-    logging.info('add static  {}'.format(path))
+def create_assets(prebuilt=False, **kw):
+    root = os.path.dirname(os.path.abspath(__file__))
+    path = kw.get('path', None) or os.path.join(root, 'static')
+    build = kw.get('build', None) or os.path.join(root, 'build', 'static')
+    assets = Assets(path, build, brotli=kw.get('brotli', True), level=kw.get('level', 9))
+    if prebuilt:
+        assets.load()
+    else:
+        assets.build()
+    return assets
+
+def add_static(app, prebuilt=False, **kw):
+    # prebuilt: another process already ran the build, only read its manifest
+    assets = create_assets(prebuilt, **kw)
+    app.router.add_route('GET', '/static/{path:.+}', assets.handle)
+    if '__template__' in app:
+        app['__template__'].globals['static_url'] = assets.url
+    app['__assets__'] = assets
+    logging.info('add static  {}'.format(assets.root))
+
+def toAsync(func):
+    # @get/@post wrappers are plain functions around sync or async handlers
+    @functools.wraps(func)
+    async def call(*args, **kw):
+        rs = func(*args, **kw)
+        if inspect.isawaitable(rs):
+            rs = await rs
+        return rs
+    return call
 
 def add_route(app, func):
     method = getattr(func, '__method__', None)
     path = getattr(func, '__route__', None)
     if method is None or path is None:
         raise ValueError('@get or @post not defined in {}'.format(func))
-    if not asyncio.iscoroutinefunction(func) and not inspect.isgeneratorfunction(func):
-        func = asyncio.coroutine(func)
+    if not asyncio.iscoroutinefunction(func):
+        func = toAsync(func)
     logging.info("add {} to routes".format(path))
     app.router.add_route(method, path, RequestHandler(func))
 